@@ -1,29 +1,37 @@
+import itertools
 import json
 import logging
-import logging.config
-import os
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from flask_swagger_ui import get_swaggerui_blueprint
 
 from .config import (
     API_PORT,
     API_TOKEN,
-    LOG_PATH,
-    SCRIPT_PATH,
+    LOG_FOLLOW_MAX_SECONDS,
     SWAGGER_JSON_PATH,
     SWAGGER_URL,
 )
 from .exceptions import (
     FlowAlreadyAddedException,
+    FlowAlreadyRunningException,
     FlowNotFoundException,
     FlowParsingException,
 )
 from .flow import Flow
 from .flow_runner import FlowRunner
-from .job_store import get_job, list_jobs
-from .logs import get_logs
+from .job_queue import JobQueue
+from .job_store import (
+    decode_job_cursor,
+    encode_job_cursor,
+    get_job,
+    get_job_result,
+    list_jobs,
+)
+from .logs import follow_logs, get_job_logs, get_logs, setup_logging
+from .metrics import MetricsRegistry
+from .retention import RetentionWorker
 from .scheduler_service import SchedulerService
 from .utils import parse_time_param, to_iso
 
@@ -34,17 +42,17 @@ CORS(app)
 logger = logging.getLogger(__name__)
 
 # Load logging configuration
-with open(f"{SCRIPT_PATH}/logging_config.json", mode="r") as f:
-    logging_config = json.load(f)
-    # define the log file path
-    logging_config["handlers"]["file"]["filename"] = os.path.join(
-        LOG_PATH, logging_config["handlers"]["file"]["filename"]
-    )
-    logging.config.dictConfig(logging_config)
+setup_logging()
 
 # get the scheduler instance (singleton)
 scheduler_instance = SchedulerService.get_instance()
 
+# start the job queue (singleton), it picks up the jobs queued before a restart
+job_queue = JobQueue.get_instance()
+
+# start the retention worker (singleton), it cleans up old jobs in the background
+retention_worker = RetentionWorker.get_instance()
+
 
 # --- Only for testing: add StreamHandler for console output ---
 def run_app():
@@ -141,7 +149,7 @@ def add_schedule():
 
 @app.route("/api/v1/jobs", methods=["POST"])
 def launch_job():
-    """Launch a flow as a job asynchronously and return a job_id."""
+    """Queue a flow as a job and return a job_id, without waiting for the flow."""
     data = request.json
     flow_path = data.get("path")
     payload = data.get("data")
@@ -164,7 +172,7 @@ def launch_job():
         return jsonify({"error": str(e)}), 404
     except FlowParsingException as e:
         return jsonify({"error": str(e)}), 400
-    except FlowAlreadyAddedException as e:
+    except (FlowAlreadyAddedException, FlowAlreadyRunningException) as e:
         return jsonify({"error": str(e)}), 409
     except Exception as e:
         logging.error("Error launching job: %s", e)
@@ -179,8 +187,15 @@ def list_jobs_api():
     try:
         limit = int(request.args.get("limit", 50))
         offset = int(request.args.get("offset", 0))
+        cursor = request.args.get("cursor")
+        if cursor:
+            decode_job_cursor(cursor)
+            # a cursor page starts after the previous page, an offset can't apply to it
+            if "offset" in request.args:
+                return jsonify({"error": "offset can't be combined with cursor"}), 400
         state = request.args.get("state")
         status = request.args.get("status")
+        flow_path = request.args.get("flow_path")
         start_time_from = parse_time_param(request.args.get("start_time_from"))
         start_time_to = parse_time_param(request.args.get("start_time_to"))
         end_time_from = parse_time_param(request.args.get("end_time_from"))
@@ -196,8 +211,10 @@ def list_jobs_api():
     jobs = list_jobs(
         limit=limit,
         offset=offset,
+        cursor=cursor,
         state=state,
         status=status,
+        flow_path=flow_path,
         start_time_from=start_time_from,
         start_time_to=start_time_to,
         end_time_from=end_time_from,
@@ -206,16 +223,23 @@ def list_jobs_api():
     jobs_meta = [
         {
             "id": job.id,
+            "flow_path": job.flow_path,
             "meta": job.meta,
             "errors": job.errors,
             "state": job.state.value if job.state else None,
             "status": job.status.value if job.status else None,
             "start_time": to_iso(job.start_time),
             "end_time": to_iso(job.end_time) if job.end_time else None,
+            "resume_at": to_iso(job.resume_at) if job.resume_at else None,
         }
         for job in jobs
     ]
-    return jsonify({"jobs": jobs_meta, "limit": limit, "offset": offset}), 200
+    # a full page means there could be more jobs, pass next_cursor to get the next page
+    next_cursor = encode_job_cursor(jobs[-1]) if jobs and len(jobs) == limit else None
+    response = {"jobs": jobs_meta, "limit": limit, "next_cursor": next_cursor}
+    if not cursor:
+        response["offset"] = offset
+    return jsonify(response), 200
 
 
 @app.route("/api/v1/jobs/<job_id>", methods=["GET"])
@@ -227,17 +251,48 @@ def get_job_api(job_id):
     return jsonify(
         {
             "id": job.id,
+            "flow_path": job.flow_path,
             "meta": job.meta,
             "state": job.state.value if job.state else None,
             "status": job.status.value if job.status else None,
             "start_time": to_iso(job.start_time),
             "end_time": to_iso(job.end_time) if job.end_time else None,
-            "result": job.result,
+            "resume_at": to_iso(job.resume_at) if job.resume_at else None,
+            "result": get_job_result(job.id),
             "errors": job.errors,
+            "timings": job.timings,
         }
     ), 200
 
 
+@app.route("/api/v1/jobs/<job_id>/logs", methods=["GET"])
+def get_job_logs_api(job_id):
+    """
+    Get the log lines of a specific job.
+    Query params:
+      - lines (int) - number of lines to return (default: 100)
+      - level (string, optional) - only lines of this level or higher (e.g. WARNING)
+    """
+    try:
+        lines = int(request.args.get("lines", 100))
+    except ValueError:
+        return jsonify({"error": "Invalid 'lines' parameter"}), 400
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    try:
+        logs = get_job_logs(job_id, lines, level=request.args.get("level"))
+        return jsonify({"job_id": job_id, "logs": logs}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({"job_id": job_id, "logs": []}), 200
+    except Exception as e:
+        logging.error("Error fetching logs of job %s: %s", job_id, e)
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/api/v1/jobs", methods=["DELETE"])
 def delete_jobs():
     """
@@ -282,28 +337,72 @@ def delete_job_by_id(job_id):
         return jsonify({"error": "Job not found"}), 404
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Expose the metrics of the spooler in the Prometheus text format."""
+    return Response(
+        MetricsRegistry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.route("/api/v1/logs", methods=["GET"])
 def fetch_logs():
     """
     Fetch the latest log lines.
-    Query param: lines (int) - number of lines to return (default: 100)
+    Query params:
+      - lines (int) - number of lines to return (default: 100)
+      - job_id (string, optional) - only lines of this job
+      - flow (string, optional) - only lines of this flow
+      - level (string, optional) - only lines of this level or higher (e.g. WARNING)
+      - follow (bool, optional) - stream new lines as server-sent events
     """
     try:
         lines = int(request.args.get("lines", 100))
     except ValueError:
         return jsonify({"error": "Invalid 'lines' parameter"}), 400
+    job_id = request.args.get("job_id")
+    flow = request.args.get("flow")
+    level = request.args.get("level")
+    follow = request.args.get("follow", "false").lower() in ["true", "1", "yes"]
 
     try:
-        logs = get_logs(lines)
+        if follow:
+            return stream_logs(job_id=job_id, flow=flow, level=level)
+        logs = get_logs(lines, job_id=job_id, flow=flow, level=level)
         return jsonify({"logs": logs}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except FileNotFoundError as e:
-        return jsonify({"error": e}), 404
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         logging.error("Error fetching logs: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
+def stream_logs(job_id=None, flow=None, level=None):
+    """Stream the new log lines as server-sent events, until the client disconnects."""
+    records = follow_logs(
+        job_id=job_id, flow=flow, level=level, max_seconds=LOG_FOLLOW_MAX_SECONDS
+    )
+    # start the generator now, so a missing log file or bad level is reported as an error
+    first = next(records, None)
+
+    def events():
+        yield ": following logs\n\n"
+        for record in itertools.chain([first], records):
+            if record is None:
+                # keepalive, also detects a disconnected client
+                yield ": keepalive\n\n"
+                continue
+            data = "\n".join(f"data: {line}" for line in record.rstrip("\n").split("\n"))
+            yield f"{data}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     run_app()
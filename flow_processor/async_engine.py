@@ -0,0 +1,209 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import requests
+
+from flow_processor.config import (
+    ASYNC_OFFLOAD_WORKERS,
+    FLOW_ENGINE,
+    HTTP_KEEPALIVE,
+    HTTP_POOL_MAX_CONNECTIONS,
+    HTTP_POOL_SIZE,
+)
+from flow_processor.http_pool import SessionPool
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, the requests run in threads when not installed
+    aiohttp = None
+
+# the jobs run as coroutines on the shared event loop (FLOW_ENGINE=async)
+ASYNC_ENGINE = FLOW_ENGINE == "async"
+
+# seconds before a session dropped from the pool is closed, lets its requests finish
+SESSION_CLOSE_DELAY_SECONDS = 60
+
+if FLOW_ENGINE not in ("thread", "async"):
+    logging.warning("Unknown FLOW_ENGINE '%s', the thread engine is used", FLOW_ENGINE)
+if ASYNC_ENGINE and aiohttp is None:
+    logging.warning("aiohttp is not installed, the REST requests of the async engine run in threads")
+
+
+class EventLoop:
+    """
+    The shared event loop of the async engine, running in its own thread.
+
+    The jobs of the async engine are coroutines on this loop, the I/O bound steps
+    (rest, sleep, flow, flow_loop) await on it, the cpu bound steps (jq, jinja, ...)
+    are offloaded to a small thread pool (ASYNC_OFFLOAD_WORKERS).
+    The loop is started by the first job.
+    """
+
+    _loop = None
+    _lock = threading.Lock()
+    _offload_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=ASYNC_OFFLOAD_WORKERS, thread_name_prefix="offload"
+    )
+
+    @classmethod
+    def get(cls):
+        with cls._lock:
+            if cls._loop is None:
+                logging.info("Starting the event loop of the async engine")
+                cls._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=cls._loop.run_forever, name="event-loop", daemon=True
+                ).start()
+            return cls._loop
+
+    @classmethod
+    def submit(cls, coroutine):
+        """Run a coroutine on the shared loop, from any thread. Returns a concurrent future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, cls.get())
+
+
+class StopEvent(threading.Event):
+    """
+    The stop event of a job, set by the job queue watchdog when the job times out.
+
+    A threading.Event the sleeps of a flow wait on, so a stopped flow wakes up at
+    once. Coroutines wait on it with wait_async, without blocking the event loop.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._waiters = set()  # (loop, future) of the coroutines waiting for the event
+        self._waiters_lock = threading.Lock()
+
+    def set(self):
+        super().set()
+        with self._waiters_lock:
+            waiters = list(self._waiters)
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    async def wait_async(self, timeout=None):
+        """Wait until the event is set or the timeout expires, return True if the event is set."""
+        if self.is_set():
+            return True
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._waiters_lock:
+            self._waiters.add(waiter)
+        try:
+            # the event could have been set before the waiter was added
+            if not self.is_set():
+                await asyncio.wait([waiter[1]], timeout=timeout)
+        finally:
+            with self._waiters_lock:
+                self._waiters.discard(waiter)
+        return self.is_set()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+async def offload(func, *args, **kwargs):
+    """Run a blocking (cpu bound) function in the offload pool and wait for it.
+
+    The function runs in a copy of the current context, keeps the job id in the logs.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        EventLoop._offload_executor,
+        functools.partial(context.run, func, *args, **kwargs),
+    )
+
+
+class AsyncResponse:
+    """The parts of a requests.Response the REST step uses, for an aiohttp response."""
+
+    def __init__(self, status_code, content, headers, url):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.url = url
+
+    def json(self):
+        return json.loads(self.content)
+
+    @property
+    def links(self):
+        """The parsed Link header, like requests.Response.links."""
+        links = {}
+        header = self.headers.get("link")
+        if header:
+            for link in requests.utils.parse_header_links(header):
+                links[link.get("rel") or link.get("url")] = link
+        return links
+
+
+class AsyncSessionPool:
+    """
+    The aiohttp sessions of the event loop, one session per base url, like the SessionPool.
+
+    Only used from the event loop thread, so no lock is needed. The connections per
+    host are limited by HTTP_POOL_MAX_CONNECTIONS, the hosts by HTTP_POOL_SIZE.
+    """
+
+    _sessions = OrderedDict()
+
+    @classmethod
+    def get(cls, url):
+        key = SessionPool.base_url(url)
+        session = cls._sessions.get(key)
+        if session is not None:
+            cls._sessions.move_to_end(key)
+            return session
+
+        logging.debug("Creating async HTTP session for %s", key)
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit_per_host=HTTP_POOL_MAX_CONNECTIONS,
+                force_close=not HTTP_KEEPALIVE,
+                ssl=False,
+            ),
+            # never share cookies between flows, every request authenticates on its own
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+        cls._sessions[key] = session
+        while len(cls._sessions) > HTTP_POOL_SIZE:
+            _, dropped = cls._sessions.popitem(last=False)
+            asyncio.get_running_loop().call_later(
+                SESSION_CLOSE_DELAY_SECONDS, asyncio.ensure_future, dropped.close()
+            )
+        return session
+
+
+async def http_request(method, uri, params=None, headers=None, body=None):
+    """Make an HTTP request from the event loop.
+
+    Uses aiohttp when installed, otherwise the pooled requests session in a thread.
+    The body is sent as json, when given.
+    """
+    if aiohttp is None:
+        session = SessionPool.get(uri)
+        return await asyncio.to_thread(
+            session.request,
+            method,
+            uri,
+            params=params,
+            headers=headers,
+            json=body,
+            verify=False,
+        )
+
+    session = AsyncSessionPool.get(uri)
+    async with session.request(
+        method, uri, params=params, headers=headers, json=body
+    ) as response:
+        content = await response.read()
+        return AsyncResponse(response.status, content, response.headers, str(response.url))
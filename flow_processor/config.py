@@ -24,6 +24,18 @@ SCRIPT_PATH = os.path.dirname(__file__)
 
 # --- Database ---
 DATABASE_URL = f"sqlite:///{JOBS_DB_PATH}"
+SQLITE_BUSY_TIMEOUT_MS = int(
+    os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000)
+)  # Default: wait up to 5 seconds for a database lock
+SQLITE_MMAP_SIZE = int(
+    os.getenv("SQLITE_MMAP_SIZE", 268435456)
+)  # Default: 256 MB memory mapped I/O
+JOB_RESULT_COMPRESSION = os.getenv(
+    "JOB_RESULT_COMPRESSION", "gzip"
+).lower()  # Default: gzip (gzip, zstd or none)
+JOB_WRITE_INTERVAL_SECONDS = float(
+    os.getenv("JOB_WRITE_INTERVAL_SECONDS", 0.5)
+)  # Default: job updates are written every 0.5 seconds
 
 # --- Timezone ---
 TIMEZONE = os.getenv("TIMEZONE", "Europe/Brussels")
@@ -33,6 +45,29 @@ TZ = pytz.timezone(TIMEZONE)
 API_PORT = int(os.getenv("API_PORT", 5000))
 API_TOKEN = os.getenv("API_TOKEN", "default_token")
 
+# --- Logging ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # Default: INFO
+LOG_FILE_NAME = os.getenv("LOG_FILE_NAME", "spooler_service.log")
+LOG_FILE_MAX_BYTES = int(
+    os.getenv("LOG_FILE_MAX_BYTES", 52428800)
+)  # Default: rotate the log file at 50 MB
+LOG_FILE_BACKUP_COUNT = int(
+    os.getenv("LOG_FILE_BACKUP_COUNT", 5)
+)  # Default: keep 5 rotated log files
+JOB_LOG_LEVEL = os.getenv(
+    "JOB_LOG_LEVEL", "INFO"
+).upper()  # Default: the logs of a job are kept at INFO level
+JOB_LOG_BUFFER_LINES = int(
+    os.getenv("JOB_LOG_BUFFER_LINES", 1000)
+)  # Default: the last 1000 log lines of a job are kept in memory
+JOB_LOG_MAX_JOBS = int(
+    os.getenv("JOB_LOG_MAX_JOBS", 100)
+)  # Default: the logs of the last 100 jobs are kept in memory
+JOB_LOG_FILES = os.getenv("JOB_LOG_FILES", "false").lower() in ["true", "1", "yes"]
+LOG_FOLLOW_MAX_SECONDS = int(
+    os.getenv("LOG_FOLLOW_MAX_SECONDS", 3600)
+)  # Default: a log follow stream is closed after 1 hour
+
 # --- Swagger ---
 SWAGGER_URL = "/api/docs"
 SWAGGER_JSON_PATH = os.path.join(BASE_PATH, "static/swagger.json")
@@ -45,4 +80,41 @@ HASHICORP_VAULT_CACHE_TTL = int(
 
 # --- Flow ---
 FLOW_TIMEOUT_SECONDS = int(os.getenv("FLOW_TIMEOUT", 600))  # Default: 10 minutes
-FLOW_MAX_WORKERS = int(os.getenv("FLOW_MAX_WORKERS", 8))  # Default: 8 workers
\ No newline at end of file
+FLOW_MAX_WORKERS = int(os.getenv("FLOW_MAX_WORKERS", 8))  # Default: 8 workers
+JOB_QUEUE_POLL_SECONDS = float(
+    os.getenv("JOB_QUEUE_POLL_SECONDS", 2)
+)  # Default: check for queued jobs every 2 seconds
+FLOW_LOOP_MAX_CONCURRENCY = int(
+    os.getenv("FLOW_LOOP_MAX_CONCURRENCY", 10)
+)  # Default: 10 items of a flow_loop in parallel
+FLOW_LOOP_MAX_WORKERS = int(
+    os.getenv("FLOW_LOOP_MAX_WORKERS", 32)
+)  # Default: 32 threads shared by the flow_loop items of all jobs (thread engine)
+FLOW_ENGINE = os.getenv(
+    "FLOW_ENGINE", "thread"
+).lower()  # Default: every job runs in a worker thread (thread or async)
+ASYNC_MAX_JOBS = int(
+    os.getenv("ASYNC_MAX_JOBS", 1000)
+)  # Default: 1000 jobs in flight on the event loop of the async engine
+ASYNC_OFFLOAD_WORKERS = int(
+    os.getenv("ASYNC_OFFLOAD_WORKERS", 4)
+)  # Default: 4 threads for the cpu bound steps of the async engine
+SLEEP_DEFER_SECONDS = float(
+    os.getenv("SLEEP_DEFER_SECONDS", 30)
+)  # Default: a job sleeping 30 seconds or more releases its worker (0 disables)
+
+# --- Templates ---
+JINJA_TEMPLATE_CACHE_SIZE = int(
+    os.getenv("JINJA_TEMPLATE_CACHE_SIZE", 512)
+)  # Default: 512 compiled templates
+JQ_PROGRAM_CACHE_SIZE = int(
+    os.getenv("JQ_PROGRAM_CACHE_SIZE", 512)
+)  # Default: 512 compiled jq programs
+
+# --- HTTP ---
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))  # Default: 32 hosts
+HTTP_POOL_MAX_CONNECTIONS = int(
+    os.getenv("HTTP_POOL_MAX_CONNECTIONS", 10)
+)  # Default: 10 connections per host
+HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "true").lower() in ["true", "1", "yes"]
+HTTP_KEEPALIVE = os.getenv("HTTP_KEEPALIVE", "true").lower() in ["true", "1", "yes"]
@@ -1,19 +1,20 @@
+import asyncio
 import logging
-import os
-import re
+import time
 
-import yaml
-
-from flow_processor.config import FLOWS_PATH, SECRETS_PATH
-from flow_processor.exceptions import (
-    FlowExitException,
-    FlowNotFoundException,
-    FlowParsingException,
-)
+from flow_processor.async_engine import offload
+from flow_processor.exceptions import FlowExitException
+from flow_processor.flow_cache import FlowCache
+from flow_processor.job_store import save_checkpoint
+from flow_processor.metrics import STEP_DURATION
+from flow_processor.timings import new_timings, record_step
 from flow_processor.utils import make_timestamp
 
 from .step_factory import create_step
 
+# a resumable flow writes a full checkpoint after this many checkpoint deltas
+CHECKPOINT_COMPACT_STEPS = 100
+
 
 class Flow:
     """
@@ -24,41 +25,44 @@ class Flow:
     def validate_path(flow_path):
         """
         Validate the flow path to prevent directory traversal and ensure it is a YAML file.
+        The flow plan is compiled as well, so invalid steps raise a FlowParsingException.
         """
-        try:
-            with open(os.path.join(FLOWS_PATH, flow_path), "r") as file:
-                flow_config = yaml.safe_load(file)
-        except FileNotFoundError:
-            raise FlowNotFoundException(f"Flow file {flow_path} not found.")
-        except yaml.YAMLError as e:
-            raise FlowParsingException(f"Failed to parse flow file {flow_path}: {e}")
-        except Exception as e:
-            raise e
-
-    def __init__(self, path, payload={}, loop_index=None, job_id=None):
-        flow = {}
+        FlowCache.get(flow_path)
 
-        try:
-            with open(os.path.join(FLOWS_PATH, path), "r") as file:
-                flow = yaml.safe_load(file)
-        except FileNotFoundError:
-            raise FlowNotFoundException(f"Flow file not found: {path}")
-        except yaml.YAMLError as e:
-            raise FlowParsingException(f"Failed to parse flow file: {path}: {e}")
-        except Exception as e:
-            raise e
+    def __init__(self, path, payload={}, loop_index=None, job_id=None, can_defer=False):
+        # parsed flows are cached process-wide, only re-parsed when the file changes
+        flow = FlowCache.get(path)
 
-        self._name = flow.get("name")
+        self._name = flow["name"]
         self._path = path
-        self._steps = flow.get("steps", [])
+        self._steps = flow["steps"]
+        self._plan = flow["plan"]
+        # the step objects of this run, created on the first visit of a step
+        self._step_objects = {}
+        # the stop event of the job, set while the flow is processed
+        self._stop_event = None
+        # a deferred flow (a long sleep) returns with status "deferred" and is processed
+        # again after resume_at, from the next step, see SleepStep and the JobQueue.
+        # A suspended flow (wait_until) is checkpointed to the job store instead.
+        self._can_defer = can_defer
+        self._resume_at = None
+        self._durable = False
+        self._resume_idx = 0
+        self._started = None
+        self._started_at = None
+        # a resumable job flow stores a checkpoint after every step, restarted jobs go on
+        # from it (see checkpoint_delta), only the data the step changed is written
+        self._resumable = can_defer and flow["resumable"]
+        self._current_idx = 0
+        self._changed_keys = set()  # the data keys changed since the last checkpoint
+        self._errors_count = 0  # the errors already in the last checkpoint
+        self._deltas = 0
+        self._loop_progress = None  # the progress of an interrupted flow_loop, see restore
         self._data = {}
         self._data["__errors__"] = []  # a list of errors that occurred during the flow
         self._data["__input__"] = (
             payload  # a flow can have an input payload, from a parent, or from the api
         )
-        self._secrets = (
-            self._load_secrets()
-        )  # each flow loads the secrets and temporarily stores them in the flow
         self._data["__loop_index__"] = (
             loop_index  # a flow can have an index, for example, when looping over a list
         )
@@ -71,11 +75,14 @@ class Flow:
         self._data["__flow_path__"] = (
             path  # the path of the flow, for reference, in case it's required later in a step
         )
+        self._data["__timings__"] = (
+            new_timings()
+        )  # the execution time of every step, aggregated per step name
         self._representation = f"[{self._name}]"
         if loop_index:
             self._representation += f"[{loop_index}]"
 
-        self._step_dict = {step["name"]: idx for idx, step in enumerate(self._steps)}
+        self._step_dict = flow["step_dict"]
 
     def __repr__(self):
         repr = f"[{self._name}][{self._data.get('__loop_index__')}]"
@@ -86,113 +93,44 @@ class Flow:
 
         failed = False
         failed_message = None
-        result = None
+        self._start(stop_event)
 
         try:
             #####################################
             # START THE FLOW PROCESSING
             #####################################
 
-            # initial step
-            current_idx = 0
+            # initial step, or the step after the sleep of a deferred flow
+            current_idx = self._resume_idx
 
             # as long as we have steps to process
             while current_idx < len(self._steps) and (not stop_event or not stop_event.is_set()):
 
-                # get the current step
-                step = self._steps[current_idx]
-                step_obj = create_step(step, self)
-
+                compiled_step, step_obj = self._bind_step(current_idx)
+                step_start = time.perf_counter()
                 try:
 
                     # process the step
                     result = step_obj.process()
 
-
                 except FlowExitException as e:
                     # an explicit exit from the flow, we will return the data and the exit message
                     return self._data, {"type": "exit", "message": str(e)}
 
                 # we want to catch all errors in the step, and continue the flow if required
                 except Exception as e:
-                    # Get a good representation of the error
-                    if hasattr(e, "__dict__") and e.__dict__:
-                        error_detail = dict(e.__dict__)
-                    else:
-                        error_detail = str(e)
-                    error_obj = {"step": step["name"], "error": error_detail}
-                    error_one_line = (
-                        str(dict(e.__dict__)).replace("\n", " ").replace("\r", " ")
-                    )
-                    continue_step = False
-                    logging.error(
-                        "%s Error in step %s: %s",
-                        self._representation,
-                        step["name"],
-                        str(e),
-                    )
-                    # check if the step has ignore_errors, if so, we will ignore the error if the regex matches
-                    for err_regex in step.get("ignore_errors", []):
-                        if re.match(err_regex, error_one_line):
-                            logging.warning(
-                                "%s Ignoring error in step %s: %s",
-                                self._representation,
-                                step["name"],
-                                str(e),
-                            )
-                            error_obj["ignored"] = (
-                                f"Error ignored based on regex: {err_regex}"
-                            )
-                            continue_step = True
-                            break
-                    # store the error in the flow data
-                    self._data["__errors__"].append(error_obj)
-
-                    # error occurred, end of the line, we break the loop
-                    if not continue_step:
-
-                        # Check if the step defines a 'on_error_goto' property
-                        on_error_goto = step.get("on_error_goto")
-                        if on_error_goto:
-                            logging.info(
-                                "%s on_error_goto triggered in step %s: going to %s",
-                                self._representation,
-                                step["name"],
-                                on_error_goto,
-                            )
-                            result = {"goto": on_error_goto}
-                        else:
-                            # error, no ignore, no goto, end of the flow with error
-                            raise e
+                    result = self._handle_step_error(compiled_step, e)
+                finally:
+                    self._record_step(compiled_step, step_obj, step_start)
 
                 # Check for the next step based on the result of the current step
-                if isinstance(result, dict) and "goto" in result:
-                    goto_name = result["goto"]
-                    match goto_name:
-                        case "__exit":
-                            logging.info("%s Exiting flow %s", self._representation, self._name)
-                            # we return the data and the exit message
-                            return self._data, {"type": "exit", "message": "Flow exited."}
-                        case "__end__":
-                            # special case to end the flow, we exit the loop
-                            logging.info("%s Ending flow %s", self._representation, self._name)
-                            current_idx = len(self._steps)
-                        case "__start__":
-                            # special case to end the flow, we exit the loop
-                            logging.info("%s Goto start of flow %s", self._representation, self._name)
-                            # goto_name = self._steps[0].name 
-                            current_idx = 0  
-                        case _: 
-                            if goto_name not in self._step_dict:
-                                # bad goto step, we raise an exception
-                                raise Exception(f"Goto step '{goto_name}' not found in flow.")
-                            
-                            logging.info("%s Goto step %s", self._representation, goto_name)
-                            current_idx = self._step_dict[goto_name]
-                else:
-                    # no goto, just take the next step
-                    logging.debug("%s next step of flow %s", self._representation, self._name)
-                    current_idx += 1
+                current_idx, status = self._next_step(current_idx, result)
+                if status:
+                    return self._data, status
+                self._checkpoint(current_idx)
+                if self._resume_at is not None:
+                    # the worker is released, the job queue resumes the flow later
+                    return self._data, self._hand_back(current_idx)
 
             # in case the flow was stopped but no error ever occurred.
             if stop_event and stop_event.is_set():
@@ -209,17 +147,299 @@ class Flow:
             failed = True
 
         finally:
-            logging.debug("%s Flow %s finished.", self._representation, self._name)
+            self._finish()
+
+        return self._status(failed, failed_message)
+
+    async def process_async(self, stop_event=None):
+        """Process the flow as a coroutine, in the async engine.
+
+        Same control flow as process(), the steps run with process_async: the I/O bound
+        steps await on the event loop, the cpu bound steps are offloaded to threads.
+        """
+
+        failed = False
+        failed_message = None
+        # binding a step (secrets) and checkpointing block, they run off the event loop
+        await offload(self._start, stop_event)
+
+        try:
+            current_idx = self._resume_idx
+            while current_idx < len(self._steps) and (not stop_event or not stop_event.is_set()):
 
+                compiled_step, step_obj = await offload(self._bind_step, current_idx)
+                step_start = time.perf_counter()
+                try:
+                    result = await step_obj.process_async()
+                except FlowExitException as e:
+                    return self._data, {"type": "exit", "message": str(e)}
+                except Exception as e:
+                    result = self._handle_step_error(compiled_step, e)
+                finally:
+                    self._record_step(compiled_step, step_obj, step_start)
+
+                current_idx, status = self._next_step(current_idx, result)
+                if status:
+                    return self._data, status
+                if self._resumable:
+                    await offload(self._checkpoint, current_idx)
+                if self._resume_at is not None:
+                    return self._data, self._hand_back(current_idx)
+
+            if stop_event and stop_event.is_set():
+                logging.info("%s Flow %s stopping on request.", self._representation, self._name)
+                return self._data, {"type": "failed", "message": "Flow stopped on request."}
+
+        except Exception as e:
+            logging.error("%s Error in flow: %s", self._representation, str(e))
+            failed = True
+        except asyncio.CancelledError:
+            # the task of the flow is cancelled, let the caller know
+            raise
+        except BaseException as be:
+            logging.error("%s BaseException in flow: %s", self._representation, str(be))
+            failed = True
+
+        finally:
+            self._finish()
+
+        return self._status(failed, failed_message)
+
+    def defer(self, resume_at, durable=False):
+        """Stop the flow after the current step, it is resumed after resume_at.
+
+        A deferred flow stays in memory (SleepStep), a durable one is checkpointed to the
+        job store and survives a restart (WaitUntilStep).
+        """
+        self._resume_at = resume_at
+        self._durable = durable
+
+    def checkpoint(self, next_idx=None):
+        """Return the full checkpoint of the flow, restore() continues the flow from it."""
+        self._reset_changes()
+        return {
+            "next_step": self._step_name(self._resume_idx if next_idx is None else next_idx),
+            "started": self._started_at,
+            "data": self._data,
+            "loop": None,
+        }
+
+    def checkpoint_delta(self, next_idx, loop=None):
+        """Return the changes of the flow since the last checkpoint.
+
+        Only the data keys the steps changed (see Step._patch) and the new errors are
+        in a delta, with the step to resume at and the progress of a running flow_loop.
+        """
+        errors = self._data["__errors__"]
+        delta = {
+            "next_step": self._step_name(next_idx),
+            "started": self._started_at,
+            "data": {key: self._data[key] for key in self._changed_keys if key in self._data},
+            "errors": errors[self._errors_count :],
+            "loop": loop,
+        }
+        delta["data"]["__timings__"] = self._data["__timings__"]
+        self._reset_changes()
+        return delta
+
+    def checkpoint_loop(self, step_name, done, total, results, summary):
+        """Store the progress of a flow_loop step of a resumable flow, after every chunk."""
+        if not self._resumable:
+            return
+        loop = {
+            "step": step_name,
+            "done": done,
+            "total": total,
+            "results": results,
+            "summary": summary,
+        }
+        save_checkpoint(
+            self._data["__job_id__"], self.checkpoint_delta(self._current_idx, loop), delta=True
+        )
+
+    def take_loop_progress(self, step_name, total):
+        """Return the progress of a flow_loop step that was interrupted by a restart, once."""
+        progress, self._loop_progress = self._loop_progress, None
+        if not progress or progress["step"] != step_name:
+            return None
+        if progress["total"] != total:
+            logging.warning(
+                "%s The list of %s changed, the loop starts over", self._representation, step_name
+            )
+            return None
+        return progress
+
+    def restore(self, checkpoint):
+        """Continue a suspended or interrupted flow, from its last checkpoint."""
+        next_step = checkpoint.get("next_step")
+        if next_step is None:
+            self._resume_idx = len(self._steps)
+        elif next_step in self._step_dict:
+            self._resume_idx = self._step_dict[next_step]
+        else:
+            raise Exception(f"Step '{next_step}' to resume at not found in flow.")
+        self._data.update(checkpoint["data"])
+        self._loop_progress = checkpoint.get("loop")
+        self._errors_count = len(self._data["__errors__"])
+        # the flow counts from its first start, the time it was suspended included
+        self._started_at = checkpoint["started"] or time.time()
+        self._started = time.perf_counter() - (time.time() - self._started_at)
+
+    def _checkpoint(self, next_idx):
+        """Store the checkpoint of a resumable flow after a step, mostly as a delta."""
+        if not self._resumable:
+            return
+        job_id = self._data["__job_id__"]
+        if self._deltas >= CHECKPOINT_COMPACT_STEPS:
+            save_checkpoint(job_id, self.checkpoint(next_idx))
+            self._deltas = 0
+        else:
+            save_checkpoint(job_id, self.checkpoint_delta(next_idx), delta=True)
+            self._deltas += 1
+
+    def _reset_changes(self):
+        self._changed_keys = set()
+        self._errors_count = len(self._data["__errors__"])
+
+    def _step_name(self, idx):
+        # the step name, the index could change when the flow file is changed meanwhile
+        return self._steps[idx]["name"] if idx < len(self._steps) else None
+
+    def data_changed(self, key):
+        """Note a data key a step changed, for the next checkpoint delta."""
+        self._changed_keys.add(key)
+
+    def _start(self, stop_event):
+        self._stop_event = stop_event
+        self._resume_at = None
+        if self._started is None:
+            self._started = time.perf_counter()
+            self._started_at = time.time()
+            # the job of a resumable flow is resumed after a restart, even in its first step
+            self._checkpoint(self._resume_idx)
+
+    def _hand_back(self, current_idx):
+        """Return the status of a deferred or suspended flow, it goes on at current_idx."""
+        self._resume_idx = current_idx
+        status_type = "suspended" if self._durable else "deferred"
+        return {"type": status_type, "resume_at": self._resume_at}
+
+    def _bind_step(self, current_idx):
+        """Return the compiled step and the step object of a step, bound to the flow data."""
+        # the step object is created on the first visit and reused on every next visit
+        compiled_step = self._plan.steps[current_idx]
+        self._current_idx = current_idx
+        step_obj = self._step_objects.get(current_idx)
+        if step_obj is None:
+            step_obj = create_step(compiled_step.step, self, compiled_step)
+            self._step_objects[current_idx] = step_obj
+        step_obj.bind()
+        return compiled_step, step_obj
+
+    def _handle_step_error(self, compiled_step, e):
+        """Store the error of a step and return the result to continue with, raises it if the flow must fail."""
+        step = compiled_step.step
+        # Get a good representation of the error
+        if hasattr(e, "__dict__") and e.__dict__:
+            error_detail = dict(e.__dict__)
+        else:
+            error_detail = str(e)
+        error_obj = {"step": step["name"], "error": error_detail}
+        error_one_line = (
+            str(dict(e.__dict__)).replace("\n", " ").replace("\r", " ")
+        )
+        continue_step = False
+        logging.error(
+            "%s Error in step %s: %s",
+            self._representation,
+            step["name"],
+            str(e),
+        )
+        # check if the step has ignore_errors, if so, we will ignore the error if the regex matches
+        for err_regex, pattern in compiled_step.ignore_errors:
+            if pattern.match(error_one_line):
+                logging.warning(
+                    "%s Ignoring error in step %s: %s",
+                    self._representation,
+                    step["name"],
+                    str(e),
+                )
+                error_obj["ignored"] = (
+                    f"Error ignored based on regex: {err_regex}"
+                )
+                continue_step = True
+                break
+        # store the error in the flow data
+        self._data["__errors__"].append(error_obj)
+
+        # error ignored, continue with the next step
+        if continue_step:
+            return None
+
+        # Check if the step defines a 'on_error_goto' property
+        on_error_goto = step.get("on_error_goto")
+        if on_error_goto:
+            logging.info(
+                "%s on_error_goto triggered in step %s: going to %s",
+                self._representation,
+                step["name"],
+                on_error_goto,
+            )
+            return {"goto": on_error_goto}
+
+        # error, no ignore, no goto, end of the flow with error
+        raise e
+
+    def _record_step(self, compiled_step, step_obj, step_start):
+        """Add the execution time of a step to the timings of the flow."""
+        step = compiled_step.step
+        elapsed = time.perf_counter() - step_start
+        record_step(
+            self._data["__timings__"],
+            step["name"],
+            step.get("type"),
+            elapsed,
+            step_obj._metrics,
+        )
+        STEP_DURATION.observe(elapsed, type=step.get("type"))
+
+    def _next_step(self, current_idx, result):
+        """Return the index of the next step, and the status of the flow if it exits."""
+        if not (isinstance(result, dict) and "goto" in result):
+            # no goto, just take the next step
+            logging.debug("%s next step of flow %s", self._representation, self._name)
+            return current_idx + 1, None
+
+        goto_name = result["goto"]
+        match goto_name:
+            case "__exit":
+                logging.info("%s Exiting flow %s", self._representation, self._name)
+                # we return the data and the exit message
+                return current_idx, {"type": "exit", "message": "Flow exited."}
+            case "__end__":
+                # special case to end the flow, we exit the loop
+                logging.info("%s Ending flow %s", self._representation, self._name)
+                return len(self._steps), None
+            case "__start__":
+                logging.info("%s Goto start of flow %s", self._representation, self._name)
+                return 0, None
+            case _:
+                if goto_name not in self._step_dict:
+                    # bad goto step, we raise an exception
+                    raise Exception(f"Goto step '{goto_name}' not found in flow.")
+
+                logging.info("%s Goto step %s", self._representation, goto_name)
+                return self._step_dict[goto_name], None
+
+    def _finish(self):
+        # a deferred flow counts from its first start, the time it waited included
+        self._data["__timings__"]["total"] = round(time.perf_counter() - self._started, 6)
+        logging.debug("%s Flow %s finished.", self._representation, self._name)
+
+    def _status(self, failed, failed_message):
         if failed:
             return self._data, {"type": "failed", "message": failed_message}
-        else:
-            return self._data, {
-                "type": "success",
-                "message": "Flow completed successfully.",
-            }
-
-    def _load_secrets(self):
-        """Load secrets from a YAML file."""
-        with open(SECRETS_PATH, "r") as file:
-            return yaml.safe_load(file)
+        return self._data, {
+            "type": "success",
+            "message": "Flow completed successfully.",
+        }
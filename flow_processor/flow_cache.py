@@ -0,0 +1,96 @@
+import logging
+import os
+import threading
+
+import yaml
+
+from flow_processor.config import FLOWS_PATH
+from flow_processor.exceptions import FlowNotFoundException, FlowParsingException
+from flow_processor.plan import FlowPlan
+from flow_processor.utils import file_signature
+
+
+class FlowCache:
+    """
+    Process-wide cache of parsed flow files.
+
+    Each entry holds the parsed flow name, step list, step index and the compiled
+    flow plan, and is invalidated as soon as the mtime or size of the flow file changes.
+    Entries are shared between Flow instances and must be treated as read-only.
+    """
+
+    _cache = {}
+    _lock = threading.Lock()
+    _hits = 0
+    _misses = 0
+
+    @classmethod
+    def get(cls, path):
+        """Return the parsed flow for the given path, parsing it only when needed."""
+        full_path = os.path.join(FLOWS_PATH, path)
+        try:
+            signature = file_signature(full_path)
+        except FileNotFoundError:
+            raise FlowNotFoundException(f"Flow file not found: {path}")
+
+        with cls._lock:
+            entry = cls._cache.get(full_path)
+            if entry and entry["signature"] == signature:
+                cls._hits += 1
+                return entry
+            cls._misses += 1
+
+        # parse outside of the lock, a concurrent parse of the same file is harmless
+        entry = cls._parse(full_path, path, signature)
+        with cls._lock:
+            cls._cache[full_path] = entry
+        return entry
+
+    @classmethod
+    def _parse(cls, full_path, path, signature):
+        logging.debug("Parsing flow file %s", full_path)
+        try:
+            with open(full_path, "r") as file:
+                flow = yaml.safe_load(file)
+        except FileNotFoundError:
+            raise FlowNotFoundException(f"Flow file not found: {path}")
+        except yaml.YAMLError as e:
+            raise FlowParsingException(f"Failed to parse flow file: {path}: {e}")
+
+        if not isinstance(flow, dict):
+            raise FlowParsingException(f"Failed to parse flow file: {path}: not a mapping")
+
+        resumable = flow.get("resumable", False)
+        if not isinstance(resumable, bool):
+            raise FlowParsingException(f"Invalid flow {path}: resumable must be true or false")
+
+        steps = flow.get("steps", []) or []
+        # validates the steps, raises a FlowParsingException for an invalid flow
+        plan = FlowPlan(path, steps)
+        return {
+            "signature": signature,
+            "name": flow.get("name"),
+            "steps": steps,
+            "step_dict": plan.step_dict,
+            "plan": plan,
+            "resumable": resumable,
+        }
+
+    @classmethod
+    def invalidate(cls, path=None):
+        """Drop one flow (or all flows) from the cache."""
+        with cls._lock:
+            if path is None:
+                cls._cache.clear()
+            else:
+                cls._cache.pop(os.path.join(FLOWS_PATH, path), None)
+
+    @classmethod
+    def stats(cls):
+        """Return the cache counters."""
+        with cls._lock:
+            return {
+                "hits": cls._hits,
+                "misses": cls._misses,
+                "size": len(cls._cache),
+            }
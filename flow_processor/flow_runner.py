@@ -1,11 +1,20 @@
 import concurrent.futures
-import threading
 import logging
 import time
 
+from flow_processor.async_engine import offload
 from flow_processor.flow import Flow
-from flow_processor.utils import make_json_safe
-from flow_processor.job_store import JobState, JobStatus, create_job, update_job
+from flow_processor.logs import current_job_id
+from flow_processor.metrics import JOB_DURATION, JOB_LAUNCHES
+from flow_processor.utils import make_json_safe, to_iso
+from flow_processor.job_store import (
+    JobState,
+    JobStatus,
+    create_job,
+    load_checkpoint,
+    suspend_job,
+    update_job,
+)
 from flow_processor.config import FLOW_MAX_WORKERS, FLOW_TIMEOUT_SECONDS
 import json
 
@@ -16,120 +25,237 @@ executor = concurrent.futures.ThreadPoolExecutor(max_workers=FLOW_MAX_WORKERS)
 class FlowRunner:
     @staticmethod
     def launch_async(flow_path, payload=None, timeout=FLOW_TIMEOUT_SECONDS, meta=None):
+        """Queue a flow as a job and return the job id immediately.
 
-        logging.info("Launching flow '%s' with timeout '%s' seconds", flow_path, timeout)
+        The job is persisted as pending, the job queue picks it up as soon as a worker is free.
+        """
+        from flow_processor.job_queue import JobQueue  # recursive import
 
-        stop_event = threading.Event()
+        timeout = timeout or FLOW_TIMEOUT_SECONDS
+        logging.info("Queueing flow '%s' with timeout '%s' seconds", flow_path, timeout)
 
-        job_id = create_job(
-            meta=meta
-            or {"flow_path": flow_path, "payload": payload, "timeout": timeout}
+        meta = dict(
+            meta or {"flow_path": flow_path, "payload": payload, "timeout": timeout}
         )
+        meta["timeout"] = meta.get("timeout") or timeout
+        job_id = create_job(meta=meta)
+        JOB_LAUNCHES.inc(flow_path=flow_path, source=meta.get("source", "api"))
 
-        def run():
-            update_job(
+        # wake up the job queue, no need to wait for the next poll
+        JobQueue.get_instance().notify()
+        return job_id
+
+    @staticmethod
+    def run_job(
+        job_id, flow_path, payload=None, stop_event=None, timeout=None, flow=None, resume=False
+    ):
+        """Run a claimed job in the current (worker) thread and store its outcome.
+
+        A flow that is deferred by a long sleep releases the worker, the flow and the
+        time to resume it are returned and the job queue passes the flow back (flow=...)
+        when it is due. A suspended flow (wait_until) is checkpointed to the job store,
+        the job queue resumes it from the checkpoint (resume=True).
+        Returns None when the job is finished or suspended.
+        """
+        # tag all log records of this job (also of its child flows) with the job id
+        token = current_job_id.set(job_id)
+        started = time.time()
+        status = JobStatus.failed
+        handed_back = False
+        try:
+            if flow is None:
+                flow = FlowRunner._create_flow(job_id, flow_path, payload, resume)
+            if flow._started is not None:
+                # a resumed job, its duration counts from its first start
+                started -= time.perf_counter() - flow._started
+            result, status_result = flow.process(stop_event=stop_event)
+            handed_back = FlowRunner._hand_back(job_id, flow, status_result, stop_event)
+            if handed_back:
+                if status_result["type"] == "deferred":
+                    return flow, status_result["resume_at"]
+                return None
+            status = FlowRunner._store_outcome(
+                job_id, flow_path, result, status_result, stop_event, timeout
+            )
+        except Exception as e:
+            FlowRunner._store_error(job_id, flow_path, e)
+        except BaseException as be:
+            FlowRunner._store_critical_error(job_id, flow_path, be)
+            raise
+        finally:
+            current_job_id.reset(token)
+            if not handed_back:
+                JOB_DURATION.observe(
+                    time.time() - started, flow_path=flow_path, status=status.value
+                )
+
+    @staticmethod
+    async def run_job_async(
+        job_id, flow_path, payload=None, stop_event=None, timeout=None, resume=False
+    ):
+        """Run a claimed job as a coroutine on the event loop (async engine) and store its outcome."""
+        # the task of the job has its own context, the job id is only set for this job
+        token = current_job_id.set(job_id)
+        started = time.time()
+        status = JobStatus.failed
+        handed_back = False
+        try:
+            # loading a checkpoint reads the job store, not on the event loop
+            flow = await offload(FlowRunner._create_flow, job_id, flow_path, payload, resume)
+            if flow._started is not None:
+                started -= time.perf_counter() - flow._started
+            result, status_result = await flow.process_async(stop_event=stop_event)
+            handed_back = await offload(
+                FlowRunner._hand_back, job_id, flow, status_result, stop_event
+            )
+            if handed_back:
+                return
+            # serializing, compressing and writing the result block, not on the event loop
+            status = await offload(
+                FlowRunner._store_outcome,
                 job_id,
-                state=JobState.running,
-                status=JobStatus.unknown,
-                start_time=time.time(),
+                flow_path,
+                result,
+                status_result,
+                stop_event,
+                timeout,
             )
-            try:
-                result, status_result = Flow(
-                    path=flow_path, payload=payload or {}, job_id=job_id
-                ).process(stop_event=stop_event)
-                status_type = status_result.get("type", "success")
-                status_message = status_result.get(
-                    "message", "Flow completed successfully."
+        except Exception as e:
+            await offload(FlowRunner._store_error, job_id, flow_path, e)
+        except BaseException as be:
+            FlowRunner._store_critical_error(job_id, flow_path, be)
+            raise
+        finally:
+            current_job_id.reset(token)
+            if not handed_back:
+                JOB_DURATION.observe(
+                    time.time() - started, flow_path=flow_path, status=status.value
                 )
 
-                try:
-                    # Try to serialize the result as-is
-                    json.dumps(result)
-                    safe_result = result
-                except (TypeError, OverflowError):
-                    # If it fails, sanitize it
-                    safe_result = make_json_safe(result)
-                
-                match status_type:
-                    case "exit":
-                        update_job(
-                            job_id,
-                            state=JobState.finished,
-                            status=JobStatus.exit,
-                            result=safe_result,
-                            end_time=time.time(),
-                            errors=status_message,
-                        )
-                    case "failed":
-                        update_job(
-                            job_id,
-                            state=JobState.finished,
-                            status=JobStatus.failed,
-                            result=safe_result,
-                            end_time=time.time(),
-                            errors=status_message,
-                        )
-                    case "success":
-                        update_job(
-                            job_id,
-                            state=JobState.finished,
-                            status=JobStatus.success,
-                            result=safe_result,
-                            end_time=time.time(),
-                        )
-                    case _:
-                        logging.error("Unknown status type: %s", status_type)
-                        update_job(
-                            job_id,
-                            state=JobState.finished,
-                            status=JobStatus.error,
-                            errors=f"Unknown status type: {status_type}",
-                            end_time=time.time(),
-                        )
-            except Exception as e:
-                logging.error("Flow %s failed in flow_runner: %s", flow_path, str(e))
+    @staticmethod
+    def _create_flow(job_id, flow_path, payload, resume):
+        """Create the flow of a job, a resumed job continues from its checkpoint."""
+        flow = Flow(path=flow_path, payload=payload or {}, job_id=job_id, can_defer=True)
+        if resume:
+            checkpoint = load_checkpoint(job_id)
+            if checkpoint is None:
+                raise Exception("No checkpoint found to resume the job")
+            flow.restore(checkpoint)
+            logging.info("Resuming flow %s of job %s from its checkpoint", flow_path, job_id)
+        return flow
+
+    @staticmethod
+    def _hand_back(job_id, flow, status_result, stop_event):
+        """Suspend a flow that waits (wait_until), return True if the flow is deferred or suspended.
+
+        A flow that was stopped meanwhile is not handed back, it ends as timed out.
+        """
+        status_type = status_result.get("type")
+        if status_type not in ("deferred", "suspended"):
+            return False
+        if stop_event and stop_event.is_set():
+            return False
+        if status_type == "suspended":
+            suspend_job(job_id, flow.checkpoint(), status_result["resume_at"])
+            logging.info("Job %s suspended until %s", job_id, to_iso(status_result["resume_at"]))
+        return True
+
+    @staticmethod
+    def _store_outcome(job_id, flow_path, result, status_result, stop_event, timeout):
+        """Store the result and status of a processed flow, return the job status."""
+        # the step timings are stored apart from the result
+        timings = result.pop("__timings__", None)
+        update_job(job_id, timings=timings)
+        status_type = status_result.get("type", "success")
+        status_message = status_result.get(
+            "message", "Flow completed successfully."
+        )
+
+        try:
+            # Try to serialize the result as-is
+            json.dumps(result)
+            safe_result = result
+        except (TypeError, OverflowError):
+            # If it fails, sanitize it
+            safe_result = make_json_safe(result)
+
+        # the stop event is set by the job queue watchdog when the job times out
+        if stop_event and stop_event.is_set():
+            logging.error(
+                "Flow %s timed out after %s seconds, job %s marked as failed",
+                flow_path,
+                timeout,
+                job_id,
+            )
+            update_job(
+                job_id,
+                state=JobState.finished,
+                status=JobStatus.failed,
+                result=safe_result,
+                end_time=time.time(),
+                errors=f"Flow timed out after {timeout} seconds",
+            )
+            return JobStatus.failed
+
+        match status_type:
+            case "exit":
                 update_job(
                     job_id,
                     state=JobState.finished,
-                    status=JobStatus.failed,
-                    errors=str(e),
+                    status=JobStatus.exit,
+                    result=safe_result,
                     end_time=time.time(),
+                    errors=status_message,
                 )
-            
-            except BaseException as be:
-                logging.error("Critical error in flow %s: %s", flow_path, str(be))
+                return JobStatus.exit
+            case "failed":
                 update_job(
                     job_id,
                     state=JobState.finished,
                     status=JobStatus.failed,
-                    errors=f"Critical error: {str(be)}",
+                    result=safe_result,
                     end_time=time.time(),
+                    errors=status_message,
                 )
-                raise
-
-        # Submit the job to the shared executor and handle timeout
-        future = executor.submit(run)
-        try:
-            # This will raise concurrent.futures.TimeoutError if the job takes too long
-            future.result(timeout=timeout)
-        except concurrent.futures.TimeoutError:
-            logging.error(f"Flow {flow_path} not responding after {timeout} seconds, sending stop event")
-            stop_event.set()
-            while not future.done():
+                return JobStatus.failed
+            case "success":
                 update_job(
                     job_id,
-                    state=JobState.stopping
-                )           
-                logging.info(f"Waiting for flow {flow_path} to stop gracefully...")
-                time.sleep(5)
-    
-            update_job(
-                job_id,
-                state=JobState.finished,
-                status=JobStatus.failed,
-                errors=f"Flow timed out after {timeout} seconds",
-                end_time=time.time(),
-            )
-            logging.error(f"Flow {flow_path} timed out after {timeout} seconds, job {job_id} marked as failed")
+                    state=JobState.finished,
+                    status=JobStatus.success,
+                    result=safe_result,
+                    end_time=time.time(),
+                )
+                return JobStatus.success
+            case _:
+                logging.error("Unknown status type: %s", status_type)
+                update_job(
+                    job_id,
+                    state=JobState.finished,
+                    status=JobStatus.error,
+                    errors=f"Unknown status type: {status_type}",
+                    end_time=time.time(),
+                )
+                return JobStatus.error
 
-        return job_id
+    @staticmethod
+    def _store_error(job_id, flow_path, e):
+        logging.error("Flow %s failed in flow_runner: %s", flow_path, str(e))
+        update_job(
+            job_id,
+            state=JobState.finished,
+            status=JobStatus.failed,
+            errors=str(e),
+            end_time=time.time(),
+        )
+
+    @staticmethod
+    def _store_critical_error(job_id, flow_path, be):
+        logging.error("Critical error in flow %s: %s", flow_path, str(be))
+        update_job(
+            job_id,
+            state=JobState.finished,
+            status=JobStatus.failed,
+            errors=f"Critical error: {str(be)}",
+            end_time=time.time(),
+        )
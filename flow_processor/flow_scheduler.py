@@ -17,6 +17,7 @@ from flow_processor.exceptions import (
 )
 from flow_processor.flow import Flow
 from flow_processor.flow_runner import FlowRunner
+from flow_processor.metrics import SCHEDULER_LAG
 
 
 class FlowScheduler:
@@ -134,6 +135,13 @@ class FlowScheduler:
         """Schedule a flow to run every X seconds."""
 
         def job_wrapper():
+            # next_run is still the planned start, the schedule library updates it after the run
+            job = self.flows[schedule_id].get("job")
+            if job and job.next_run:
+                SCHEDULER_LAG.observe(
+                    max(0.0, (datetime.now() - job.next_run).total_seconds()),
+                    schedule_type="every_seconds",
+                )
             try:
                 # You can set a default timeout here if you want
                 self.run_scheduled_flow(
@@ -178,6 +186,10 @@ class FlowScheduler:
                 delay = (next_run - now).total_seconds()
                 if stop_event.wait(timeout=delay):
                     break
+                SCHEDULER_LAG.observe(
+                    max(0.0, (datetime.now(TZ) - next_run).total_seconds()),
+                    schedule_type="cron",
+                )
                 job_wrapper()
 
         thread = Thread(target=cron_job, daemon=True)
@@ -0,0 +1,80 @@
+import logging
+import threading
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from flow_processor.config import (
+    HTTP_KEEPALIVE,
+    HTTP_POOL_BLOCK,
+    HTTP_POOL_MAX_CONNECTIONS,
+    HTTP_POOL_SIZE,
+)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class SessionPool:
+    """
+    Process-wide pool of HTTP sessions, one session per base url (scheme, host and port).
+
+    Sessions keep their connections alive between requests, so consecutive calls
+    to the same host (AWX, ServiceNow, Jira, Vault) reuse the TCP/TLS connection.
+    The number of connections per host is limited by HTTP_POOL_MAX_CONNECTIONS,
+    the number of hosts kept in the pool by HTTP_POOL_SIZE (least recently used
+    hosts are dropped first).
+    """
+
+    _sessions = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def base_url(url):
+        """Return the scheme://host:port part of an url, used as pool key."""
+        parts = urlsplit(url)
+        scheme = (parts.scheme or "http").lower()
+        port = parts.port or DEFAULT_PORTS.get(scheme)
+        return f"{scheme}://{(parts.hostname or '').lower()}:{port}"
+
+    @classmethod
+    def get(cls, url):
+        """Return the shared session for the host of the given url."""
+        key = cls.base_url(url)
+        with cls._lock:
+            session = cls._sessions.get(key)
+            if session is not None:
+                cls._sessions.move_to_end(key)
+                return session
+
+            logging.debug("Creating HTTP session for %s", key)
+            session = cls._create_session()
+            cls._sessions[key] = session
+            while len(cls._sessions) > HTTP_POOL_SIZE:
+                # dropped sessions are closed once no request is using them anymore
+                cls._sessions.popitem(last=False)
+            return session
+
+    @staticmethod
+    def _create_session():
+        session = requests.Session()
+        # never share cookies between flows, every request authenticates on its own
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=HTTP_POOL_MAX_CONNECTIONS,
+            pool_block=HTTP_POOL_BLOCK,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not HTTP_KEEPALIVE:
+            session.headers["Connection"] = "close"
+        return session
+
+    @classmethod
+    def stats(cls):
+        """Return the hosts currently in the pool."""
+        with cls._lock:
+            return {"hosts": list(cls._sessions.keys()), "size": len(cls._sessions)}
@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+from threading import Event, Thread
+
+from flow_processor.async_engine import ASYNC_ENGINE, EventLoop, StopEvent
+from flow_processor.config import (
+    ASYNC_MAX_JOBS,
+    FLOW_MAX_WORKERS,
+    FLOW_TIMEOUT_SECONDS,
+    JOB_QUEUE_POLL_SECONDS,
+)
+from flow_processor.flow_runner import FlowRunner, executor
+from flow_processor.job_store import (
+    claim_jobs,
+    list_due_jobs,
+    list_pending_jobs,
+    mark_job_stopping,
+    next_resume_time,
+    resume_jobs,
+)
+from flow_processor.metrics import JOB_QUEUE_WAIT
+
+# how often the watchdog checks the running jobs for timeouts
+WATCHDOG_INTERVAL_SECONDS = 1
+
+# we make the job queue a singleton, like the scheduler service
+# the first call to get_instance starts the dispatcher and watchdog threads
+
+
+class JobQueue:
+    """
+    Persistent job queue on top of the job store.
+
+    Jobs are queued as pending jobs in the job store. A dispatcher thread claims
+    pending jobs and hands them to the shared worker pool (FLOW_MAX_WORKERS), and
+    a watchdog thread stops the jobs that run longer than their timeout.
+    With the async engine the jobs run as coroutines on the shared event loop
+    instead, up to ASYNC_MAX_JOBS at the same time.
+
+    A job that is deferred by a long sleep (SLEEP_DEFER_SECONDS) releases its worker,
+    it stays in the running jobs and the dispatcher resumes it when it is due.
+    A suspended job (wait_until) is only in the job store, the dispatcher resumes it
+    from its checkpoint when it is due, before the pending jobs.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._wakeup = Event()
+        self._lock = threading.Lock()
+        self._running = {}  # job_id -> running job info (stop_event, deadline, deferred flow, ...)
+        # the number of jobs that run at the same time
+        self.max_jobs = ASYNC_MAX_JOBS if ASYNC_ENGINE else FLOW_MAX_WORKERS
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = JobQueue()
+                cls._instance._start()
+            return cls._instance
+
+    def _start(self):
+        logging.info(
+            "Starting job queue with %s %s",
+            self.max_jobs,
+            "async jobs" if ASYNC_ENGINE else "workers",
+        )
+        Thread(target=self._dispatch_loop, daemon=True).start()
+        Thread(target=self._watchdog_loop, daemon=True).start()
+
+    def notify(self):
+        """Wake up the dispatcher, e.g. when a job was queued or a worker became free."""
+        self._wakeup.set()
+
+    def running_jobs(self):
+        """Return the ids of the jobs currently running in this process."""
+        with self._lock:
+            return list(self._running.keys())
+
+    def _dispatch_loop(self):
+        while True:
+            self._wakeup.wait(timeout=self._next_wakeup())
+            self._wakeup.clear()
+            try:
+                self._dispatch()
+            except Exception as e:
+                logging.error("Exception in job queue dispatcher: %s", e)
+
+    def _next_wakeup(self):
+        """Seconds until the next poll, or until the next deferred job is due."""
+        with self._lock:
+            resume_times = [job["resume_at"] for job in self._running.values() if job["deferred"]]
+        suspended_until = next_resume_time()
+        if suspended_until is not None:
+            resume_times.append(suspended_until)
+        if not resume_times:
+            return JOB_QUEUE_POLL_SECONDS
+        return max(0, min(JOB_QUEUE_POLL_SECONDS, min(resume_times) - time.time()))
+
+    def _dispatch(self):
+        """Resume the due deferred and suspended jobs, then claim as many pending jobs as there are free workers."""
+        now = time.time()
+        with self._lock:
+            due = [
+                job_id
+                for job_id, job in self._running.items()
+                if job["deferred"] and job["resume_at"] <= now
+            ]
+        # the deferred jobs go first, they were started before the pending ones
+        for job_id in due:
+            self._resume(job_id)
+
+        with self._lock:
+            free_workers = self.max_jobs - sum(
+                1 for job in self._running.values() if not job["deferred"]
+            )
+        if free_workers <= 0:
+            return
+
+        due_jobs = list_due_jobs(limit=free_workers)
+        with self._lock:
+            # the worker that suspended a job could still be finishing
+            due_jobs = [job for job in due_jobs if job.id not in self._running]
+        # another process could have resumed some of the jobs in the meantime
+        resumed = resume_jobs([job.id for job in due_jobs]) if due_jobs else set()
+        for job in due_jobs:
+            if job.id in resumed:
+                self._submit(job, resume=True)
+                free_workers -= 1
+        if free_workers <= 0:
+            return
+
+        pending_jobs = list_pending_jobs(limit=free_workers)
+        # another process could have claimed some of the jobs in the meantime
+        claimed = claim_jobs([job.id for job in pending_jobs]) if pending_jobs else set()
+        for job in pending_jobs:
+            if job.id in claimed:
+                self._submit(job)
+
+    def _submit(self, job, resume=False):
+        meta = job.meta or {}
+        flow_path = meta.get("flow_path")
+        timeout = meta.get("timeout") or FLOW_TIMEOUT_SECONDS
+        stop_event = StopEvent()
+
+        if resume:
+            # every run of a suspended job has the full timeout
+            logging.info("Resuming suspended job %s for flow '%s'", job.id, flow_path)
+        else:
+            logging.info("Starting job %s for flow '%s'", job.id, flow_path)
+            # start_time is still the time the job was queued, claim_jobs resets it
+            JOB_QUEUE_WAIT.observe(max(0.0, time.time() - (job.start_time or time.time())))
+        with self._lock:
+            self._running[job.id] = {
+                "flow_path": flow_path,
+                "payload": meta.get("payload"),
+                "stop_event": stop_event,
+                "timeout": timeout,
+                "deadline": time.time() + timeout,
+                "deferred": False,
+                "flow": None,
+                "resume_at": None,
+            }
+        if ASYNC_ENGINE:
+            future = EventLoop.submit(
+                FlowRunner.run_job_async(
+                    job.id,
+                    flow_path,
+                    payload=meta.get("payload"),
+                    stop_event=stop_event,
+                    timeout=timeout,
+                    resume=resume,
+                )
+            )
+        else:
+            future = executor.submit(
+                FlowRunner.run_job,
+                job.id,
+                flow_path,
+                payload=meta.get("payload"),
+                stop_event=stop_event,
+                timeout=timeout,
+                resume=resume,
+            )
+        future.add_done_callback(lambda f, job_id=job.id: self._done(job_id, f))
+
+    def _resume(self, job_id):
+        """Hand a deferred job back to the worker pool, the flow goes on after its sleep."""
+        with self._lock:
+            job = self._running.get(job_id)
+            if job is None or not job["deferred"]:
+                return
+            flow = job["flow"]
+            job.update(deferred=False, flow=None, resume_at=None)
+
+        logging.info("Resuming job %s for flow '%s'", job_id, job["flow_path"])
+        future = executor.submit(
+            FlowRunner.run_job,
+            job_id,
+            job["flow_path"],
+            payload=job["payload"],
+            stop_event=job["stop_event"],
+            timeout=job["timeout"],
+            flow=flow,
+        )
+        future.add_done_callback(lambda f, job_id=job_id: self._done(job_id, f))
+
+    def _done(self, job_id, future):
+        deferred = None
+        if not future.cancelled() and future.exception() is None:
+            deferred = future.result()
+        with self._lock:
+            if deferred:
+                # the job waits without a worker, the dispatcher resumes it when it is due
+                flow, resume_at = deferred
+                self._running[job_id].update(deferred=True, flow=flow, resume_at=resume_at)
+                logging.info("Job %s deferred, resumed in %.0f seconds", job_id, resume_at - time.time())
+            else:
+                self._running.pop(job_id, None)
+        # a worker became free
+        self.notify()
+
+    def _watchdog_loop(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVAL_SECONDS)
+            try:
+                self._enforce_timeouts()
+            except Exception as e:
+                logging.error("Exception in job queue watchdog: %s", e)
+
+    def _enforce_timeouts(self):
+        now = time.time()
+        with self._lock:
+            expired = [
+                (job_id, job)
+                for job_id, job in self._running.items()
+                if now > job["deadline"] and not job["stop_event"].is_set()
+            ]
+        for job_id, job in expired:
+            logging.error(
+                "Flow %s not responding after %s seconds, sending stop event",
+                job["flow_path"],
+                job["timeout"],
+            )
+            mark_job_stopping(job_id)
+            job["stop_event"].set()
+            # a deferred job is resumed at once, it stops and is marked as timed out
+            self._resume(job_id)
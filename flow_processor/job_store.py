@@ -1,26 +1,83 @@
+import atexit
+import base64
+import binascii
+import concurrent.futures
 import enum
+import gzip
+import json
 import logging
+import threading
 import time
 import uuid
+from threading import Thread
 
-from sqlalchemy import JSON, Column, Enum, String, Text, create_engine
+from sqlalchemy import (
+    JSON,
+    Column,
+    Enum,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    and_,
+    bindparam,
+    create_engine,
+    event,
+    func,
+    inspect,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import defer, sessionmaker
 from sqlalchemy.types import Float
 
-from flow_processor.config import DATABASE_URL
+from flow_processor.config import (
+    DATABASE_URL,
+    JOB_RESULT_COMPRESSION,
+    JOB_WRITE_INTERVAL_SECONDS,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_MMAP_SIZE,
+)
 from flow_processor.exceptions import FlowAlreadyRunningException
+from flow_processor.logs import JobLogStore
+from flow_processor.utils import make_json_safe
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, gzip is used when not installed
+    zstandard = None
 
 Base = declarative_base()
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(bind=engine)
 
 
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection, WAL lets readers and the writer work concurrently."""
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    # only has effect on a new database, lets the retention worker give freed pages back
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
 class JobState(enum.Enum):
     pending = "pending"
     running = "running"
     finished = "finished"
     stopping = "stopping"
+    suspended = "suspended"  # waits for resume_at without a worker, see suspend_job
 
 
 class JobStatus(enum.Enum):
@@ -35,83 +92,618 @@ class Job(Base):
     __tablename__ = "jobs"
     id = Column(String, primary_key=True, index=True)
     meta = Column(JSON, nullable=True)
+    flow_path = Column(String, nullable=True, index=True)
+    # legacy, results are stored compressed in the job_results table, see JobResult
     result = Column(JSON, nullable=True)
     errors = Column(Text, nullable=True)
-    state = Column(Enum(JobState), default=JobState.pending)
-    status = Column(Enum(JobStatus), default=JobStatus.unknown)
-    start_time = Column(Float, default=time.time)
-    end_time = Column(Float, nullable=True)
+    timings = Column(JSON, nullable=True)  # the step timings of the flow, see timings.py
+    state = Column(Enum(JobState), default=JobState.pending, index=True)
+    status = Column(Enum(JobStatus), default=JobStatus.unknown, index=True)
+    start_time = Column(Float, default=time.time, index=True)
+    end_time = Column(Float, nullable=True, index=True)
+    resume_at = Column(Float, nullable=True, index=True)  # when a suspended job is resumed
+
+
+class JobResult(Base):
+    """The (compressed) result of a job, kept out of the jobs table so listing jobs stays cheap."""
+
+    __tablename__ = "job_results"
+    job_id = Column(String, primary_key=True)
+    encoding = Column(String, nullable=False)
+    size = Column(Integer, nullable=True)  # size of the uncompressed json
+    data = Column(LargeBinary, nullable=True)
+
+
+class JobCheckpoint(Base):
+    """The (compressed) checkpoint of a job: its flow data and the step to resume at.
+
+    A suspended job has a full checkpoint, a resumable job adds a JobCheckpointDelta
+    after every step, load_checkpoint applies the deltas to the checkpoint.
+    """
+
+    __tablename__ = "job_checkpoints"
+    job_id = Column(String, primary_key=True)
+    encoding = Column(String, nullable=False)
+    size = Column(Integer, nullable=True)  # size of the uncompressed json
+    data = Column(LargeBinary, nullable=True)
+    created = Column(Float, default=time.time)
+
+
+class JobCheckpointDelta(Base):
+    """The flow data changed by a step of a resumable job, the next step and the loop progress."""
+
+    __tablename__ = "job_checkpoint_deltas"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String, nullable=False, index=True)
+    encoding = Column(String, nullable=False)
+    size = Column(Integer, nullable=True)  # size of the uncompressed json
+    data = Column(LargeBinary, nullable=True)
+    created = Column(Float, default=time.time)
+
+
+def _encode_result(result):
+    """Serialize and compress a job result, return (encoding, size, data)."""
+    raw = json.dumps(result).encode("utf-8")
+    match JOB_RESULT_COMPRESSION:
+        case "zstd" if zstandard is not None:
+            return "zstd", len(raw), zstandard.ZstdCompressor().compress(raw)
+        case "zstd" | "gzip":
+            return "gzip", len(raw), gzip.compress(raw, compresslevel=6)
+        case _:
+            return "none", len(raw), raw
+
+
+def _decode_result(encoding, data):
+    """Decompress and deserialize a job result."""
+    if data is None:
+        return None
+    match encoding:
+        case "zstd":
+            if zstandard is None:
+                raise Exception("Job result is zstd compressed, install zstandard to read it")
+            raw = zstandard.ZstdDecompressor().decompress(data)
+        case "gzip":
+            raw = gzip.decompress(data)
+        case _:
+            raw = data
+    return json.loads(raw)
+
+
+if JOB_RESULT_COMPRESSION == "zstd" and zstandard is None:
+    logging.warning("zstandard is not installed, job results are compressed with gzip")
+
+
+# at most one unfinished job per flow, enforced by the database
+Index(
+    "ux_jobs_unfinished_flow_path",
+    Job.flow_path,
+    unique=True,
+    sqlite_where=Job.state != JobState.finished,
+    postgresql_where=Job.state != JobState.finished,
+)
+
+# keyset pagination of the job list, see list_jobs
+Index("ix_jobs_start_time_id", Job.start_time, Job.id)
+
+
+def _migrate_schema():
+    """Bring an existing jobs database up to date with the Job model."""
+    columns = [c["name"] for c in inspect(engine).get_columns("jobs")]
+    # all missing columns go first, a query of the Job model selects every column
+    new_columns = (("flow_path", "VARCHAR"), ("timings", "JSON"), ("resume_at", "FLOAT"))
+    for name, column_type in new_columns:
+        if name not in columns:
+            logging.info("Migrating jobs table: adding %s column", name)
+            with engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}"))
+
+    if "flow_path" not in columns:
+        _backfill_flow_path()
+
+    # create the indexes that are missing on tables created by an older version
+    for index in Job.__table__.indexes:
+        try:
+            index.create(bind=engine, checkfirst=True)
+        except IntegrityError as e:
+            logging.error("Failed to create index %s: %s", index.name, e)
+
+
+def _backfill_flow_path(batch_size=1000):
+    """Fill the flow_path of the existing jobs from their meta, batch by batch."""
+    last_id = ""
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(Job.id, Job.meta)
+                .where(Job.flow_path.is_(None), Job.id > last_id)
+                .order_by(Job.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return
+            connection.execute(
+                update(Job)
+                .where(Job.id == bindparam("job_id"))
+                .values(flow_path=bindparam("path")),
+                [{"job_id": job_id, "path": (meta or {}).get("flow_path")} for job_id, meta in rows],
+            )
+        last_id = rows[-1].id
 
 
 Base.metadata.create_all(bind=engine)
+_migrate_schema()
+
+
+class RunningFlowRegistry:
+    """
+    In-memory registry of the flows that have an unfinished job.
+
+    Makes the "already running" check of create_job a set lookup in the common case.
+    The registry only knows the jobs this process created, a job can be finished by
+    another process (any job queue can claim any pending job), so a hit is only a
+    hint that create_job confirms in the database. The unique index on unfinished
+    jobs per flow path is the authority, two processes can never both start a job
+    for the same flow.
+    """
+
+    def __init__(self):
+        self._jobs = {}  # job_id -> flow_path
+        self._flow_paths = set()
+        self.lock = threading.Lock()
+
+    def reload(self):
+        """Rebuild the registry from the unfinished jobs in the database."""
+        db = SessionLocal()
+        rows = (
+            db.query(Job.id, Job.flow_path)
+            .filter(Job.state != JobState.finished, Job.flow_path != None)
+            .all()
+        )
+        db.close()
+        with self.lock:
+            self._jobs = {job_id: flow_path for job_id, flow_path in rows}
+            self._flow_paths = set(self._jobs.values())
+
+    def is_running(self, flow_path):
+        return flow_path in self._flow_paths
+
+    def add(self, job_id, flow_path):
+        self._jobs[job_id] = flow_path
+        self._flow_paths.add(flow_path)
+
+    def release(self, job_id):
+        """Forget a finished job, its flow can be started again."""
+        with self.lock:
+            flow_path = self._jobs.pop(job_id, None)
+            if flow_path and flow_path not in self._jobs.values():
+                self._flow_paths.discard(flow_path)
+
+    def discard_flow(self, flow_path):
+        """Forget the jobs of a flow that were finished elsewhere, call with the lock held."""
+        self._jobs = {
+            job_id: path for job_id, path in self._jobs.items() if path != flow_path
+        }
+        self._flow_paths.discard(flow_path)
+
+
+running_flows = RunningFlowRegistry()
+running_flows.reload()
 
 
 def create_job(meta=None):
     """Create a new job and return its ID."""
     flow_path = (meta or {}).get("flow_path")
-    if flow_path:
-        db = SessionLocal()
-        from sqlalchemy import cast
+    job_id = str(uuid.uuid4())
+    job = Job(id=job_id, meta=meta or {}, flow_path=flow_path, start_time=time.time())
 
-        running = (
-            db.query(Job)
-            .filter(
-                Job.state != JobState.finished,
-                Job.meta.like(f'%"flow_path": "{flow_path}"%'),
-            )
-            .first()
-        )
-        if running:
-            db.close()
+    with running_flows.lock:
+        db = SessionLocal()
+        try:
+            if flow_path and running_flows.is_running(flow_path):
+                # confirm the hint, the job could have been finished by another process
+                if _has_unfinished_job(db, flow_path):
+                    raise FlowAlreadyRunningException(
+                        f"A job for flow '{flow_path}' is already running."
+                    )
+                running_flows.discard_flow(flow_path)
+            db.add(job)
+            db.commit()
+        except IntegrityError:
+            # another process started a job for this flow
+            db.rollback()
             raise FlowAlreadyRunningException(
                 f"A job for flow '{flow_path}' is already running."
             )
-        db.close()
-    db = SessionLocal()
-    job_id = str(uuid.uuid4())
-    job = Job(id=job_id, meta=meta or {}, start_time=time.time())
-    db.add(job)
-    db.commit()
-    db.close()
+        finally:
+            db.close()
+        if flow_path:
+            running_flows.add(job_id, flow_path)
     return job_id
 
 
+def _has_unfinished_job(db, flow_path):
+    """Tell if the flow has an unfinished job, an index lookup (ux_jobs_unfinished_flow_path)."""
+    return (
+        db.query(Job.id)
+        .filter(Job.flow_path == flow_path, Job.state != JobState.finished)
+        .first()
+        is not None
+    )
+
+
 def get_job(job_id):
+    """Return the job (metadata only), use get_job_result for the result."""
     db = SessionLocal()
-    job = db.query(Job).filter(Job.id == job_id).first()
+    job = db.query(Job).options(defer(Job.result)).filter(Job.id == job_id).first()
     db.close()
     return job
 
 
+def get_job_result(job_id):
+    """Load and decompress the result of a job."""
+    db = SessionLocal()
+    try:
+        job_result = db.get(JobResult, job_id)
+        if job_result:
+            return _decode_result(job_result.encoding, job_result.data)
+        # jobs from an older version still have their result in the jobs table
+        return db.query(Job.result).filter(Job.id == job_id).scalar()
+    finally:
+        db.close()
+
+
+class JobStateWriter:
+    """
+    Buffers job updates and writes them in a single transaction.
+
+    Updates from all workers are collected and flushed every JOB_WRITE_INTERVAL_SECONDS,
+    multiple updates of the same job are merged into one. Updates that finish or suspend
+    a job are flushed immediately, so a finished or suspended job is always persisted.
+    Transitions (claim, resume, stopping) only apply while the job is still in the state
+    they expect, they are written before the merged updates of the same flush.
+    The checkpoints of the resumable jobs are written with the same transaction.
+    """
+
+    def __init__(self, interval):
+        self._interval = interval
+        self._pending = {}  # job_id -> merged column values
+        self._checkpoints = {}  # job_id -> checkpoint rows, in the order they were made
+        self._transitions = []  # (job_id, from_state, column values, future of the outcome)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def update(self, job_id, **kwargs):
+        with self._lock:
+            self._pending.setdefault(job_id, {}).update(kwargs)
+            self._start()
+        if kwargs.get("state") in (JobState.finished, JobState.suspended):
+            self.flush()
+
+    def transition(self, job_id, from_state, **kwargs):
+        """Queue an update that only applies while the job is in from_state.
+
+        Return a future, its result is True once a flush applied the update and False
+        if the job was no longer in from_state.
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._transitions.append((job_id, from_state, kwargs, future))
+            self._start()
+        return future
+
+    def checkpoint(self, job_id, row):
+        """Queue a checkpoint (JobCheckpoint) or a checkpoint delta (JobCheckpointDelta) of a job."""
+        with self._lock:
+            self._checkpoints.setdefault(job_id, []).append(row)
+            self._start()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._flush_loop, daemon=True)
+            self._thread.start()
+
+    def flush(self):
+        """Write all buffered updates in one transaction."""
+        # one flush at a time, so updates are written in the order they were made
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                checkpoints, self._checkpoints = self._checkpoints, {}
+                transitions, self._transitions = self._transitions, []
+            if not pending and not checkpoints and not transitions:
+                return
+
+            db = SessionLocal()
+            applied = []
+            try:
+                for job_id, from_state, values, _ in transitions:
+                    updated = (
+                        db.query(Job)
+                        .filter(Job.id == job_id, Job.state == from_state)
+                        .update(
+                            {getattr(Job, key): value for key, value in values.items()},
+                            synchronize_session=False,
+                        )
+                    )
+                    applied.append(updated == 1)
+                # the checkpoint of a finished job is not needed anymore
+                finished = [
+                    job_id
+                    for job_id, values in pending.items()
+                    if values.get("state") == JobState.finished
+                ]
+                if finished:
+                    _delete_checkpoints(db, finished)
+                for job_id, rows in checkpoints.items():
+                    if job_id not in finished:
+                        _write_checkpoints(db, job_id, rows)
+                jobs = db.query(Job).filter(Job.id.in_(list(pending.keys()))).all()
+                for job in jobs:
+                    for key, value in pending[job.id].items():
+                        if key == "result":
+                            encoding, size, data = value
+                            db.merge(
+                                JobResult(
+                                    job_id=job.id, encoding=encoding, size=size, data=data
+                                )
+                            )
+                        else:
+                            setattr(job, key, value)
+                db.commit()
+                for (_, _, _, future), outcome in zip(transitions, applied):
+                    future.set_result(outcome)
+            except Exception as e:
+                db.rollback()
+                logging.error("Failed to write %s job updates: %s", len(pending), e)
+                # a transition is not retried, the job may have moved on meanwhile
+                for _, _, _, future in transitions:
+                    future.set_result(False)
+                # keep the updates for the next flush, newer updates win
+                with self._lock:
+                    for job_id, values in pending.items():
+                        self._pending[job_id] = {**values, **self._pending.get(job_id, {})}
+                    for job_id, rows in checkpoints.items():
+                        self._checkpoints[job_id] = rows + self._checkpoints.get(job_id, [])
+            finally:
+                db.close()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error("Exception in job state writer: %s", e)
+
+
+def _write_checkpoints(db, job_id, rows):
+    """Add the checkpoint rows of a job, a full checkpoint replaces the deltas before it."""
+    full = [index for index, row in enumerate(rows) if isinstance(row, JobCheckpoint)]
+    if full:
+        db.query(JobCheckpointDelta).filter(JobCheckpointDelta.job_id == job_id).delete(
+            synchronize_session=False
+        )
+        db.merge(rows[full[-1]])
+        rows = rows[full[-1] + 1 :]
+    db.add_all(rows)
+
+
+def _delete_checkpoints(db, job_ids):
+    db.query(JobCheckpoint).filter(JobCheckpoint.job_id.in_(job_ids)).delete(
+        synchronize_session=False
+    )
+    db.query(JobCheckpointDelta).filter(JobCheckpointDelta.job_id.in_(job_ids)).delete(
+        synchronize_session=False
+    )
+
+
+job_state_writer = JobStateWriter(JOB_WRITE_INTERVAL_SECONDS)
+atexit.register(job_state_writer.flush)
+
+
 def update_job(job_id, **kwargs):
+    """Queue an update of a job, updates that finish the job are written immediately."""
+    if "result" in kwargs:
+        # compress in the calling worker thread, not while holding the writer
+        kwargs["result"] = _encode_result(kwargs["result"])
+    job_state_writer.update(job_id, **kwargs)
+    if kwargs.get("state") == JobState.finished:
+        running_flows.release(job_id)
+
+
+def list_pending_jobs(limit=10):
+    """Return the oldest pending jobs, in the order they were queued."""
+    db = SessionLocal()
+    jobs = (
+        db.query(Job)
+        .filter(Job.state == JobState.pending)
+        .order_by(Job.start_time.asc())
+        .limit(limit)
+        .all()
+    )
+    db.close()
+    return jobs
+
+
+def count_jobs_by_state():
+    """Return {state: number of jobs} of all jobs in the store."""
+    db = SessionLocal()
+    rows = db.query(Job.state, func.count(Job.id)).group_by(Job.state).all()
+    db.close()
+    return {state.value: count for state, count in rows if state}
+
+
+def claim_jobs(job_ids):
+    """Move pending jobs to running in one transaction, return the ids this worker claimed.
+
+    A job another worker claimed first is left out.
+    """
+    now = time.time()
+    claims = {
+        job_id: job_state_writer.transition(
+            job_id,
+            JobState.pending,
+            state=JobState.running,
+            status=JobStatus.unknown,
+            start_time=now,
+        )
+        for job_id in job_ids
+    }
+    job_state_writer.flush()
+    return {job_id for job_id, claim in claims.items() if claim.result()}
+
+
+def suspend_job(job_id, checkpoint, resume_at):
+    """Store the checkpoint of a job and suspend it until resume_at, the job queue resumes it then.
+
+    Written at once and in one transaction, a suspended job survives a restart of the service.
+    """
+    encoding, size, data = _encode_checkpoint(checkpoint)
+    job_state_writer.checkpoint(
+        job_id, JobCheckpoint(job_id=job_id, encoding=encoding, size=size, data=data)
+    )
+    # merged with the buffered updates of the job, the suspended state is the last one
+    job_state_writer.update(job_id, state=JobState.suspended, resume_at=resume_at)
+
+
+def save_checkpoint(job_id, checkpoint, delta=False):
+    """Queue the checkpoint of a running job, a full checkpoint or a delta on top of the last one."""
+    # compress in the calling worker thread, not while holding the writer
+    encoding, size, data = _encode_checkpoint(checkpoint)
+    model = JobCheckpointDelta if delta else JobCheckpoint
+    job_state_writer.checkpoint(
+        job_id, model(job_id=job_id, encoding=encoding, size=size, data=data)
+    )
+
+
+def _encode_checkpoint(checkpoint):
+    try:
+        return _encode_result(checkpoint)
+    except (TypeError, ValueError, OverflowError):
+        # the flow data can hold values that are not json, like the job result
+        return _encode_result(make_json_safe(checkpoint))
+
+
+def load_checkpoint(job_id):
+    """Return the checkpoint of a job with its deltas applied, None if there is none."""
     db = SessionLocal()
-    job = db.query(Job).filter(Job.id == job_id).first()
-    if not job:
+    try:
+        row = db.get(JobCheckpoint, job_id)
+        deltas = (
+            db.query(JobCheckpointDelta)
+            .filter(JobCheckpointDelta.job_id == job_id)
+            .order_by(JobCheckpointDelta.id.asc())
+            .all()
+        )
+        if row is None and not deltas:
+            return None
+        checkpoint = _decode_result(row.encoding, row.data) if row else {"data": {}}
+        for delta in deltas:
+            _apply_checkpoint_delta(checkpoint, _decode_result(delta.encoding, delta.data))
+        return checkpoint
+    finally:
         db.close()
-        return None
-    for key, value in kwargs.items():
-        setattr(job, key, value)
-    db.commit()
+
+
+def _apply_checkpoint_delta(checkpoint, delta):
+    """Apply a checkpoint delta (see Flow.checkpoint_delta) to a checkpoint."""
+    checkpoint["next_step"] = delta["next_step"]
+    checkpoint["started"] = delta["started"]
+    data = checkpoint["data"]
+    data.update(delta["data"])
+    data.setdefault("__errors__", []).extend(delta["errors"])
+
+    loop = delta.get("loop")
+    previous = checkpoint.get("loop")
+    if loop and previous and previous["step"] == loop["step"]:
+        # the results of the loop items are added chunk by chunk
+        loop["results"] = previous["results"] + loop["results"]
+    checkpoint["loop"] = loop
+
+
+def list_due_jobs(limit=10, now=None):
+    """Return the suspended jobs that are due, in the order they are due."""
+    db = SessionLocal()
+    jobs = (
+        db.query(Job)
+        .options(defer(Job.result), defer(Job.timings))
+        .filter(Job.state == JobState.suspended, Job.resume_at <= (now or time.time()))
+        .order_by(Job.resume_at.asc())
+        .limit(limit)
+        .all()
+    )
     db.close()
-    return job
+    return jobs
+
+
+def next_resume_time():
+    """Return the time the next suspended job is due, None if no job is suspended."""
+    db = SessionLocal()
+    resume_at = (
+        db.query(func.min(Job.resume_at)).filter(Job.state == JobState.suspended).scalar()
+    )
+    db.close()
+    return resume_at
+
+
+def resume_jobs(job_ids):
+    """Move suspended jobs back to running in one transaction, return the ids this worker resumed.
+
+    A job another worker resumed first is left out.
+    """
+    resumes = {
+        job_id: job_state_writer.transition(
+            job_id, JobState.suspended, state=JobState.running, resume_at=None
+        )
+        for job_id in job_ids
+    }
+    job_state_writer.flush()
+    return {job_id for job_id, resume in resumes.items() if resume.result()}
+
+
+def mark_job_stopping(job_id):
+    """Queue moving a running job to stopping, a job that finished meanwhile is left untouched."""
+    job_state_writer.transition(job_id, JobState.running, state=JobState.stopping)
+
+
+def encode_job_cursor(job):
+    """Return the opaque cursor pointing after the given job in the job list."""
+    raw = json.dumps([job.start_time, job.id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_job_cursor(cursor):
+    """Return the (start_time, id) of a cursor, raise ValueError if the cursor is invalid."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        start_time, job_id = json.loads(raw)
+        return float(start_time), str(job_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor}")
 
 
 def list_jobs(
     limit=50,
     offset=0,
+    cursor=None,
     state=None,
     status=None,
+    flow_path=None,
     start_time_from=None,
     start_time_to=None,
     end_time_from=None,
     end_time_to=None,
 ):
     db = SessionLocal()
-    query = db.query(Job)
+    # metadata only, results are never loaded when listing jobs
+    query = db.query(Job).options(defer(Job.result), defer(Job.timings))
     if state:
         query = query.filter(Job.state == state)
     if status:
         query = query.filter(Job.status == status)
+    if flow_path:
+        query = query.filter(Job.flow_path == flow_path)
     if start_time_from:
         query = query.filter(Job.start_time >= start_time_from)
     if start_time_to:
@@ -120,45 +712,182 @@ def list_jobs(
         query = query.filter(Job.end_time >= end_time_from)
     if end_time_to:
         query = query.filter(Job.end_time <= end_time_to)
-    jobs = query.order_by(Job.start_time.desc()).offset(offset).limit(limit).all()
+    if cursor:
+        # keyset pagination, continue after the last job of the previous page
+        # the (start_time, id) index makes every page as cheap as the first one
+        start_time, job_id = decode_job_cursor(cursor)
+        query = query.filter(
+            or_(
+                Job.start_time < start_time,
+                and_(Job.start_time == start_time, Job.id < job_id),
+            )
+        )
+    query = query.order_by(Job.start_time.desc(), Job.id.desc())
+    if not cursor:
+        query = query.offset(offset)
+    jobs = query.limit(limit).all()
     db.close()
     return jobs
 
 
 def abandon_all_running_jobs():
-    """Mark all running jobs as abandoned (state=finished, status=unknown)."""
+    """Mark all running jobs as abandoned (state=finished, status=unknown).
+
+    Pending jobs are kept, they are still queued and will be picked up by the job queue.
+    Running jobs with a checkpoint (resumable flows) are suspended until now instead, the
+    job queue resumes them from their last checkpoint.
+    """
     logging.info("Abandoning all running jobs due to service restart.")
     db = SessionLocal()
-    jobs = db.query(Job).filter(Job.state != JobState.finished ).all()
+    jobs = (
+        db.query(Job)
+        .filter(Job.state.in_([JobState.running, JobState.stopping]))
+        .all()
+    )
+    job_ids = [job.id for job in jobs]
+    checkpointed = {
+        job_id
+        for (job_id,) in db.query(JobCheckpoint.job_id).filter(JobCheckpoint.job_id.in_(job_ids))
+    } | {
+        job_id
+        for (job_id,) in db.query(JobCheckpointDelta.job_id)
+        .filter(JobCheckpointDelta.job_id.in_(job_ids))
+        .distinct()
+    }
     now = time.time()
+    abandoned = []
     for job in jobs:
+        # a job that timed out (stopping) is not resumed
+        if job.id in checkpointed and job.state == JobState.running:
+            logging.info("Job %s is resumed from its checkpoint", job.id)
+            job.state = JobState.suspended
+            job.resume_at = now
+            continue
         job.state = JobState.finished
         job.status = JobStatus.unknown
         job.errors = (job.errors or "") + "\nAbandoned due to service restart."
         job.end_time = now
+        abandoned.append(job.id)
+    if abandoned:
+        _delete_checkpoints(db, abandoned)
     db.commit()
     db.close()
+    running_flows.reload()
+
 
+def delete_jobs_filtered(days=None, status=None, state=None, batch_size=500):
+    """Delete the matching jobs in batches, so running flows can write in between."""
+    deleted = 0
+    while True:
+        db = SessionLocal()
+        query = db.query(Job.id)
+        if days is not None:
+            cutoff = time.time() - days * 86400
+            query = query.filter(Job.end_time != None, Job.end_time < cutoff)
+        if status:
+            query = query.filter(Job.status == status)
+        if state:
+            query = query.filter(Job.state == state)
+        job_ids = [job_id for (job_id,) in query.limit(batch_size).all()]
+        db.close()
+        if not job_ids:
+            break
+        deleted += delete_jobs_by_ids(job_ids)
+    running_flows.reload()
+    return deleted
 
-def delete_jobs_filtered(days=None, status=None, state=None):
+
+def delete_jobs_by_ids(job_ids):
+    """Delete the given jobs and their results in one transaction, return the number of deleted jobs."""
     db = SessionLocal()
-    query = db.query(Job)
-    if days is not None:
-        cutoff = time.time() - days * 86400
-        query = query.filter(Job.end_time != None, Job.end_time < cutoff)
-    if status:
-        query = query.filter(Job.status == status)
-    if state:
-        query = query.filter(Job.state == state)
-    deleted = query.delete(synchronize_session=False)
+    db.query(JobResult).filter(JobResult.job_id.in_(job_ids)).delete(
+        synchronize_session=False
+    )
+    _delete_checkpoints(db, job_ids)
+    deleted = db.query(Job).filter(Job.id.in_(job_ids)).delete(
+        synchronize_session=False
+    )
     db.commit()
     db.close()
+    JobLogStore.discard(job_ids)
     return deleted
 
 
+def list_expired_job_ids(
+    end_time_before, statuses=None, exclude_statuses=None, limit=500
+):
+    """Return the ids of the finished jobs that ended before the given timestamp."""
+    db = SessionLocal()
+    query = db.query(Job.id).filter(
+        Job.state == JobState.finished,
+        Job.end_time != None,
+        Job.end_time < end_time_before,
+    )
+    if statuses:
+        query = query.filter(Job.status.in_(statuses))
+    if exclude_statuses:
+        query = query.filter(Job.status.not_in(exclude_statuses))
+    job_ids = [job_id for (job_id,) in query.limit(limit).all()]
+    db.close()
+    return job_ids
+
+
+def count_finished_jobs_per_flow(min_count=0):
+    """Return {flow_path: count} of the flows with more than min_count finished jobs."""
+    db = SessionLocal()
+    rows = (
+        db.query(Job.flow_path, func.count(Job.id))
+        .filter(Job.state == JobState.finished, Job.flow_path != None)
+        .group_by(Job.flow_path)
+        .having(func.count(Job.id) > min_count)
+        .all()
+    )
+    db.close()
+    return dict(rows)
+
+
+def list_excess_job_ids(flow_path, keep, limit=500):
+    """Return the ids of the finished jobs of a flow beyond the newest `keep` jobs."""
+    db = SessionLocal()
+    job_ids = [
+        job_id
+        for (job_id,) in db.query(Job.id)
+        .filter(Job.state == JobState.finished, Job.flow_path == flow_path)
+        .order_by(Job.start_time.desc(), Job.id.desc())
+        .offset(keep)
+        .limit(limit)
+        .all()
+    ]
+    db.close()
+    return job_ids
+
+
+def incremental_vacuum(pages=0):
+    """Give (at most `pages`, 0 is all) free database pages back to the filesystem.
+
+    Only has effect on databases created with auto_vacuum=INCREMENTAL, returns the number of freed pages.
+    """
+    if engine.dialect.name != "sqlite":
+        return 0
+    with engine.connect() as connection:
+        if connection.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+            return 0
+        free_pages = connection.execute(text("PRAGMA freelist_count")).scalar()
+        # the pragma frees one page per step, executescript steps it to completion
+        connection.connection.driver_connection.executescript(
+            f"PRAGMA incremental_vacuum({int(pages)});"
+        )
+        freed = free_pages - connection.execute(text("PRAGMA freelist_count")).scalar()
+    return freed
+
+
 def delete_job_by_id(job_id):
     db = SessionLocal()
     deleted = db.query(Job).filter(Job.id == job_id).delete()
+    db.query(JobResult).filter(JobResult.job_id == job_id).delete()
+    _delete_checkpoints(db, [job_id])
     db.commit()
     db.close()
+    running_flows.release(job_id)
+    JobLogStore.discard([job_id])
     return deleted
@@ -1,28 +1,337 @@
+import atexit
+import contextvars
 import json
+import logging
+import logging.config
+import logging.handlers
 import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict, deque
 
-from .config import LOG_PATH, SCRIPT_PATH
+from .config import (
+    JOB_LOG_BUFFER_LINES,
+    JOB_LOG_FILES,
+    JOB_LOG_LEVEL,
+    JOB_LOG_MAX_JOBS,
+    LOG_FILE_BACKUP_COUNT,
+    LOG_FILE_MAX_BYTES,
+    LOG_FILE_NAME,
+    LOG_LEVEL,
+    LOG_PATH,
+    SCRIPT_PATH,
+)
 
+# block size used to read the log file backward
+TAIL_BLOCK_SIZE = 64 * 1024
 
-def load_log_file_path() -> str:
-    """Load the log file path from the logging configuration."""
-    with open(f"{SCRIPT_PATH}/logging_config.json", "r") as f:
+# the first line of a log record, see the formatters in logging_config.json
+# lines that don't match (e.g. tracebacks) belong to the record before them
+RECORD_PATTERN = re.compile(
+    r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(,\d+)? - \S+ - (?P<level>[A-Z]+) - "
+)
+
+
+# the id of the job the current thread (or asyncio task) works for
+# set by the flow runner, copied to every log record as record.job_id
+current_job_id = contextvars.ContextVar("current_job_id", default=None)
+
+JOB_LOGS_PATH = os.path.join(LOG_PATH, "jobs")
+
+
+_base_record_factory = logging.getLogRecordFactory()
+
+# the thread that runs the log handlers, see setup_logging
+_queue_listener = None
+
+
+def _record_factory(*args, **kwargs):
+    record = _base_record_factory(*args, **kwargs)
+    record.job_id = current_job_id.get() or "-"
+    return record
+
+
+def setup_logging():
+    """Configure logging from logging_config.json.
+
+    The console and file handlers log at LOG_LEVEL, the job log handler at JOB_LOG_LEVEL,
+    so the logs of a job can be kept at DEBUG level while the log file stays at INFO.
+    The loggers only put the records on a queue, a single listener thread runs the handlers,
+    so the flows never wait for the console or the log file.
+    """
+    global _queue_listener
+
+    with open(f"{SCRIPT_PATH}/logging_config.json", mode="r") as f:
         logging_config = json.load(f)
-        return str(
-            os.path.join(LOG_PATH, logging_config["handlers"]["file"]["filename"])
-        )
+    # define the log file path and rotation
+    logging_config["handlers"]["file"]["filename"] = load_log_file_path()
+    logging_config["handlers"]["file"]["maxBytes"] = LOG_FILE_MAX_BYTES
+    logging_config["handlers"]["file"]["backupCount"] = LOG_FILE_BACKUP_COUNT
+    logging_config["handlers"]["console"]["level"] = LOG_LEVEL
+    logging_config["handlers"]["file"]["level"] = LOG_LEVEL
+    logging_config["handlers"]["job"]["level"] = JOB_LOG_LEVEL
+    logger_level = min(logging.getLevelName(LOG_LEVEL), logging.getLevelName(JOB_LOG_LEVEL))
+    for logger in logging_config["loggers"].values():
+        logger["level"] = logger_level
 
+    if _queue_listener is not None:
+        _queue_listener.stop()
+    logging.setLogRecordFactory(_record_factory)
+    logging.config.dictConfig(logging_config)
 
-def get_logs(lines=100):
-    try:
-        lines = int(lines)
-        if lines <= 0:
-            raise ValueError("Lines must be positive")
-        log_file_path = load_log_file_path()
-        if not os.path.exists(log_file_path):
-            raise FileNotFoundError(f"Log file {log_file_path} not found")
-        with open(log_file_path, "r") as f:
-            log_lines = f.readlines()[-lines:]
+    # move the configured handlers behind one queue
+    loggers = [logging.getLogger(name) for name in logging_config["loggers"]]
+    handlers = []
+    for logger in loggers:
+        handlers += [handler for handler in logger.handlers if handler not in handlers]
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    for logger in loggers:
+        logger.handlers = [queue_handler]
+
+    _queue_listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    _queue_listener.start()
+
+
+@atexit.register
+def _stop_queue_listener():
+    """Write the queued log records before the process exits."""
+    if _queue_listener is not None:
+        _queue_listener.stop()
+
+
+class JobLogStore:
+    """
+    In-memory ring buffer of the log lines of the most recent jobs.
+
+    Keeps the last JOB_LOG_BUFFER_LINES lines for the last JOB_LOG_MAX_JOBS jobs.
+    With JOB_LOG_FILES the lines are also written to <LOG_PATH>/jobs/<job_id>.log.
+    """
+
+    _buffers = OrderedDict()  # job_id -> deque of lines
+    _lock = threading.Lock()
+
+    @classmethod
+    def append(cls, job_id, line):
+        with cls._lock:
+            buffer = cls._buffers.get(job_id)
+            if buffer is None:
+                buffer = cls._buffers[job_id] = deque(maxlen=JOB_LOG_BUFFER_LINES)
+                while len(cls._buffers) > JOB_LOG_MAX_JOBS:
+                    cls._buffers.popitem(last=False)
+            buffer.append(line)
+        if JOB_LOG_FILES:
+            os.makedirs(JOB_LOGS_PATH, exist_ok=True)
+            with open(cls.file_path(job_id), "a", encoding="utf-8") as f:
+                f.write(line)
+
+    @staticmethod
+    def file_path(job_id):
+        return os.path.join(JOB_LOGS_PATH, f"{os.path.basename(job_id)}.log")
+
+    @classmethod
+    def get(cls, job_id, lines=None):
+        """Return the last log lines of a job (from memory or the job log file), None if there are none."""
+        with cls._lock:
+            buffer = cls._buffers.get(job_id)
+            log_lines = list(buffer) if buffer is not None else None
+        if log_lines is None and os.path.exists(cls.file_path(job_id)):
+            log_lines = list(_read_records_backward(cls.file_path(job_id)))
+            log_lines.reverse()
+        if log_lines is not None and lines:
+            log_lines = log_lines[-lines:]
         return log_lines
-    except Exception as e:
-        raise e
+
+    @classmethod
+    def discard(cls, job_ids):
+        """Drop the logs of deleted jobs."""
+        with cls._lock:
+            for job_id in job_ids:
+                cls._buffers.pop(job_id, None)
+        if JOB_LOG_FILES:
+            for job_id in job_ids:
+                try:
+                    os.remove(cls.file_path(job_id))
+                except FileNotFoundError:
+                    pass
+
+
+class JobLogHandler(logging.Handler):
+    """Logging handler that keeps the records of a job in the JobLogStore."""
+
+    def emit(self, record):
+        job_id = getattr(record, "job_id", "-")
+        if job_id == "-":
+            return
+        try:
+            JobLogStore.append(job_id, self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+
+def load_log_file_path() -> str:
+    """Return the path of the log file."""
+    return str(os.path.join(LOG_PATH, LOG_FILE_NAME))
+
+
+def _parse_level(level):
+    """Return the numeric log level of a level name (or number), None if not given."""
+    if level is None or level == "":
+        return None
+    if isinstance(level, int) or str(level).isdigit():
+        return int(level)
+    value = logging.getLevelName(str(level).upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Invalid log level: {level}")
+    return value
+
+
+def _make_filter(job_id=None, flow=None, level=None):
+    """Return a function that tells if a log record (string) matches the filters."""
+    min_level = _parse_level(level)
+
+    def matches(record):
+        if job_id and job_id not in record:
+            return False
+        if flow and flow not in record:
+            return False
+        if min_level is not None:
+            match = RECORD_PATTERN.match(record)
+            if not match:
+                return False
+            if logging.getLevelName(match.group("level")) < min_level:
+                return False
+        return True
+
+    return matches
+
+
+def _read_lines_backward(path, block_size=TAIL_BLOCK_SIZE):
+    """Yield the lines of a file from the last to the first, reading it in blocks from the end."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            block = f.read(read_size) + remainder
+            lines = block.split(b"\n")
+            # the first line can be incomplete, keep it for the next block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line.decode("utf-8", errors="replace") + "\n"
+        if remainder:
+            yield remainder.decode("utf-8", errors="replace") + "\n"
+
+
+def _read_records_backward(path):
+    """Yield the log records of a file from the last to the first, multi-line records as one string."""
+    continuation = []
+    first = True
+    for line in _read_lines_backward(path):
+        if first:
+            first = False
+            if line == "\n":
+                continue  # the newline at the end of the file
+        if RECORD_PATTERN.match(line):
+            yield line + "".join(reversed(continuation))
+            continuation = []
+        else:
+            continuation.append(line)
+    if continuation:
+        yield "".join(reversed(continuation))
+
+
+def get_job_logs(job_id, lines=100, level=None):
+    """Return the last log lines of a job.
+
+    The lines are taken from the job log store, for older jobs the log file is searched.
+    """
+    lines = int(lines)
+    if lines <= 0:
+        raise ValueError("Lines must be positive")
+    matches = _make_filter(level=level)
+    log_lines = JobLogStore.get(job_id)
+    if log_lines is None:
+        return get_logs(lines, job_id=f"[{job_id}]", level=level)
+    return [line for line in log_lines if matches(line)][-lines:]
+
+
+def get_logs(lines=100, job_id=None, flow=None, level=None):
+    """Return the last log records (oldest first), optionally filtered by job id, flow and minimum level.
+
+    The log file is read backward from the end, only the blocks needed are read.
+    """
+    lines = int(lines)
+    if lines <= 0:
+        raise ValueError("Lines must be positive")
+    matches = _make_filter(job_id, flow, level)
+    log_file_path = load_log_file_path()
+    if not os.path.exists(log_file_path):
+        raise FileNotFoundError(f"Log file {log_file_path} not found")
+
+    log_lines = []
+    for record in _read_records_backward(log_file_path):
+        if matches(record):
+            log_lines.append(record)
+            if len(log_lines) >= lines:
+                break
+    log_lines.reverse()
+    return log_lines
+
+
+def follow_logs(job_id=None, flow=None, level=None, poll_interval=0.5, max_seconds=None):
+    """Yield the new log records as they are written, filtered like get_logs.
+
+    Yields None every poll without new records, so the caller can send a keepalive.
+    Stops after max_seconds (if given). A rotated or truncated log file is reopened.
+    """
+    matches = _make_filter(job_id, flow, level)
+    log_file_path = load_log_file_path()
+    if not os.path.exists(log_file_path):
+        raise FileNotFoundError(f"Log file {log_file_path} not found")
+
+    deadline = time.time() + max_seconds if max_seconds else None
+    f = open(log_file_path, "rb")
+    try:
+        f.seek(0, os.SEEK_END)
+        partial = b""  # an incomplete last line
+        record = ""  # the record being read, complete once the next record starts
+        while deadline is None or time.time() < deadline:
+            data = f.read()
+            if data:
+                lines = (partial + data).split(b"\n")
+                partial = lines.pop()
+                for line in lines:
+                    line = line.decode("utf-8", errors="replace") + "\n"
+                    if RECORD_PATTERN.match(line) and record:
+                        if matches(record):
+                            yield record
+                        record = ""
+                    record += line
+                continue
+
+            # the last record is complete once nothing was written for a poll interval
+            if record and matches(record):
+                yield record
+            else:
+                yield None
+            record = ""
+            time.sleep(poll_interval)
+
+            try:
+                stat = os.stat(log_file_path)
+            except FileNotFoundError:
+                continue  # rotating, the file will be back
+            if stat.st_ino != os.fstat(f.fileno()).st_ino or stat.st_size < f.tell():
+                f.close()
+                f = open(log_file_path, "rb")
+                partial = b""
+    finally:
+        f.close()
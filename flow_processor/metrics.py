@@ -0,0 +1,257 @@
+import bisect
+import logging
+import threading
+
+from flow_processor.config import FLOW_MAX_WORKERS
+
+# default histogram buckets (seconds), from fast steps up to long running flows
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+    1800,
+    3600,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class of the metrics, a value per combination of label values.
+
+    With a callback the values are read when the metrics are collected, the
+    callback returns a value, or a list of (labels dict, value) tuples.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._callback = callback
+        MetricsRegistry.register(self)
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labels)
+
+    def collect(self):
+        """Return the lines of this metric in the Prometheus text format."""
+        if self._callback:
+            try:
+                values = self._callback()
+            except Exception as e:
+                logging.error("Failed to collect metric %s: %s", self.name, e)
+                values = []
+            if not isinstance(values, list):
+                values = [({}, values)]
+            with self._lock:
+                self._values = {self._key(labels): value for labels, value in values}
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of launched jobs."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. the number of running jobs."""
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """The distribution of observed values, e.g. job durations, in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)  # the last bucket is +Inf
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(key + (("le", _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide registry of all metrics, rendered by the /metrics endpoint."""
+
+    _metrics = []
+    _lock = threading.Lock()
+
+    @classmethod
+    def register(cls, metric):
+        with cls._lock:
+            cls._metrics.append(metric)
+
+    @classmethod
+    def render(cls):
+        """Return all metrics in the Prometheus text exposition format."""
+        with cls._lock:
+            metrics = list(cls._metrics)
+        lines = []
+        for metric in metrics:
+            lines += metric.collect()
+        return "\n".join(lines) + "\n"
+
+
+# --- the metrics of the spooler ---
+
+JOB_LAUNCHES = Counter(
+    "spooler_job_launches_total", "Number of queued jobs", ["flow_path", "source"]
+)
+JOB_DURATION = Histogram(
+    "spooler_job_duration_seconds",
+    "Duration of the jobs, from start to finish",
+    ["flow_path", "status"],
+)
+JOB_QUEUE_WAIT = Histogram(
+    "spooler_job_queue_wait_seconds",
+    "Time jobs waited in the queue for a free worker",
+)
+STEP_DURATION = Histogram(
+    "spooler_step_duration_seconds", "Duration of the step executions", ["type"]
+)
+REST_LATENCY = Histogram(
+    "spooler_rest_request_duration_seconds",
+    "Duration of the REST requests",
+    ["host", "method"],
+)
+SCHEDULER_LAG = Histogram(
+    "spooler_scheduler_lag_seconds",
+    "Delay between the planned and the actual start of a scheduled flow",
+    ["schedule_type"],
+)
+
+
+# --- collected when the metrics are rendered ---
+
+
+def _worker_stats():
+    from flow_processor.flow_runner import executor  # recursive import
+    from flow_processor.job_queue import JobQueue  # recursive import
+
+    job_queue = JobQueue._instance
+    return [
+        ({"kind": "max"}, job_queue.max_jobs if job_queue else FLOW_MAX_WORKERS),
+        ({"kind": "active"}, len(job_queue.running_jobs()) if job_queue else 0),
+        ({"kind": "threads"}, len(executor._threads)),
+    ]
+
+
+def _executor_queue_depth():
+    from flow_processor.flow_runner import executor  # recursive import
+
+    return executor._work_queue.qsize()
+
+
+def _jobs_by_state():
+    from flow_processor.job_store import count_jobs_by_state  # recursive import
+
+    return [({"state": state}, count) for state, count in count_jobs_by_state().items()]
+
+
+def _cache_stats(field):
+    from flow_processor.flow_cache import FlowCache  # recursive import
+    from flow_processor.secret_store import SecretStore  # recursive import
+    from flow_processor.utils import cache_stats  # recursive import
+
+    stats = {"flow": FlowCache.stats(), "secret": SecretStore.stats(), **cache_stats()}
+    return [({"cache": name}, values[field]) for name, values in stats.items()]
+
+
+def _http_pool_hosts():
+    from flow_processor.http_pool import SessionPool  # recursive import
+
+    return SessionPool.stats()["size"]
+
+
+WORKERS = Gauge(
+    "spooler_workers", "Job workers (max jobs, active jobs, started threads)", ["kind"], _worker_stats
+)
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    "spooler_executor_queue_depth",
+    "Jobs submitted to the worker pool that wait for a thread",
+    callback=_executor_queue_depth,
+)
+JOBS = Gauge("spooler_jobs", "Number of jobs in the job store", ["state"], _jobs_by_state)
+CACHE_HITS = Counter(
+    "spooler_cache_hits_total", "Cache hits", ["cache"], lambda: _cache_stats("hits")
+)
+CACHE_MISSES = Counter(
+    "spooler_cache_misses_total", "Cache misses", ["cache"], lambda: _cache_stats("misses")
+)
+CACHE_SIZE = Gauge(
+    "spooler_cache_size", "Entries in the cache", ["cache"], lambda: _cache_stats("size")
+)
+HTTP_POOL_HOSTS = Gauge(
+    "spooler_http_pool_hosts", "Hosts in the HTTP session pool", callback=_http_pool_hosts
+)
@@ -0,0 +1,119 @@
+import re
+from types import MappingProxyType
+
+import jinja2
+
+from flow_processor.exceptions import FlowParsingException
+from flow_processor.utils import compile_jinja2, compile_jq
+
+from .step_factory import get_step_class
+
+# goto targets handled by the flow itself, see Flow.process
+SPECIAL_TARGETS = ("__start__", "__end__", "__exit")
+
+
+def is_template(value):
+    """Tell if a string contains jinja2 syntax, e.g. a goto target that is only known at runtime."""
+    return isinstance(value, str) and ("{{" in value or "{%" in value)
+
+
+class CompiledStep:
+    """
+    A validated step of a flow plan.
+
+    Holds the step class, the (read-only) step configuration, the precompiled
+    jinja2 templates and jq programs of the configuration, keyed by their source,
+    the compiled ignore_errors regexes and the compiled steps of the switch cases.
+    """
+
+    def __init__(self, step, index=None):
+        self.step = step
+        self.index = index
+        self.name = step.get("name")
+        self.step_class = get_step_class(step.get("type"))
+        self.step_class.validate(step)
+
+        templates = {}
+        for source in self.step_class.templates(step):
+            try:
+                templates[source] = compile_jinja2(source)
+            except jinja2.exceptions.TemplateError as e:
+                raise AssertionError(f"Invalid template {source!r}: {e}")
+        self.templates = MappingProxyType(templates)
+
+        jq_programs = {}
+        for source in self.step_class.jq_expressions(step):
+            try:
+                jq_programs[source] = compile_jq(source)
+            except ValueError as e:
+                raise AssertionError(f"Invalid jq expression {source!r}: {e}")
+        self.jq_programs = MappingProxyType(jq_programs)
+
+        ignore_errors = []
+        for pattern in step.get("ignore_errors", []):
+            try:
+                ignore_errors.append((pattern, re.compile(pattern)))
+            except re.error as e:
+                raise AssertionError(f"Invalid ignore_errors regex {pattern!r}: {e}")
+        self.ignore_errors = tuple(ignore_errors)
+
+        # the steps of the switch cases are compiled with their switch step
+        self.cases = ()
+        if step.get("type") == "switch":
+            self.cases = tuple(CompiledStep(case["step"]) for case in step["switch"]["cases"])
+
+    def goto_targets(self):
+        """Yield the goto targets of the step that are known before the flow runs."""
+        if self.step.get("on_error_goto"):
+            yield self.step["on_error_goto"]
+        if self.step.get("type") == "goto":
+            step_name = self.step["goto"]["step_name"]
+            if not is_template(step_name):
+                yield step_name
+        for case in self.cases:
+            yield from case.goto_targets()
+
+
+class FlowPlan:
+    """
+    The immutable execution plan of a flow, compiled once when the flow file is parsed.
+
+    Every step is validated, its expressions are compiled and its goto targets are
+    resolved, so an invalid flow is rejected before it runs. The plan is cached with
+    the parsed flow (see FlowCache) and shared by all executions of the flow, a run
+    only binds its data to the steps.
+    """
+
+    def __init__(self, path, steps):
+        self.path = path
+        if not isinstance(steps, list):
+            raise FlowParsingException(f"Invalid flow {path}: steps must be a list")
+
+        compiled_steps = []
+        for index, step in enumerate(steps):
+            if not isinstance(step, dict) or not step.get("name"):
+                raise FlowParsingException(
+                    f"Invalid flow {path}: step {index + 1} has no name"
+                )
+            try:
+                compiled_steps.append(CompiledStep(step, index))
+            except Exception as e:
+                raise FlowParsingException(
+                    f"Invalid flow {path}: step '{step['name']}': {e}"
+                )
+        self.steps = tuple(compiled_steps)
+        self.step_dict = MappingProxyType(
+            {step.name: step.index for step in self.steps}
+        )
+
+        # resolve the goto targets against the steps of the flow
+        for step in self.steps:
+            for target in step.goto_targets():
+                if target not in SPECIAL_TARGETS and target not in self.step_dict:
+                    raise FlowParsingException(
+                        f"Invalid flow {path}: step '{step.name}': "
+                        f"goto step '{target}' not found in flow"
+                    )
+
+    def __len__(self):
+        return len(self.steps)
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from threading import Event, Thread
+
+import yaml
+
+from flow_processor.config import CONFIG_FILE
+from flow_processor.job_store import (
+    JobStatus,
+    count_finished_jobs_per_flow,
+    delete_jobs_by_ids,
+    incremental_vacuum,
+    list_excess_job_ids,
+    list_expired_job_ids,
+)
+
+# the statuses kept for keep_failed_days instead of max_age_days
+FAILED_STATUSES = [JobStatus.failed, JobStatus.error]
+
+DEFAULT_POLICY = {
+    "max_age_days": None,  # delete finished jobs older than this
+    "keep_failed_days": None,  # keep failed jobs longer, defaults to max_age_days
+    "max_count_per_flow": None,  # keep only the newest finished jobs per flow
+    "interval_seconds": 3600,  # how often the policy is enforced
+    "batch_size": 500,  # jobs deleted per transaction
+    "batch_pause_seconds": 0.1,  # pause between batches, lets the flows write
+    "vacuum_pages": 0,  # pages given back per run, 0 is all free pages
+}
+
+# we make the retention worker a singleton, like the scheduler service
+# the first call to get_instance starts the worker thread (if a policy is configured)
+
+
+class RetentionWorker:
+    """
+    Background worker that enforces the retention policy of the job store.
+
+    The policy is read from the `retention` section of config.yml. Only finished
+    jobs are deleted, in small batches so SQLite is never locked for long, and
+    free pages are given back to the filesystem with an incremental vacuum.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, policy):
+        self._policy = policy
+        self._stop = Event()
+        self._thread = None
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = RetentionWorker(cls.load_policy())
+                cls._instance._start()
+            return cls._instance
+
+    @staticmethod
+    def load_policy():
+        """Return the retention policy from config.yml, merged with the defaults."""
+        try:
+            with open(CONFIG_FILE, "r") as file:
+                config = yaml.safe_load(file) or {}
+        except FileNotFoundError:
+            config = {}
+        policy = dict(DEFAULT_POLICY)
+        policy.update(config.get("retention") or {})
+        if policy["keep_failed_days"] is None:
+            policy["keep_failed_days"] = policy["max_age_days"]
+        return policy
+
+    @property
+    def enabled(self):
+        return any(
+            self._policy[key] is not None
+            for key in ("max_age_days", "keep_failed_days", "max_count_per_flow")
+        )
+
+    def _start(self):
+        if not self.enabled:
+            logging.info("No job retention policy configured")
+            return
+        logging.info("Starting job retention worker with policy %s", self._policy)
+        self._thread = Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error("Exception in job retention worker: %s", e)
+            self._stop.wait(timeout=self._policy["interval_seconds"])
+
+    def run_once(self):
+        """Enforce the retention policy once, return the number of deleted jobs."""
+        now = time.time()
+        max_age_days = self._policy["max_age_days"]
+        keep_failed_days = self._policy["keep_failed_days"]
+        max_count = self._policy["max_count_per_flow"]
+        deleted = 0
+
+        if max_age_days is not None:
+            deleted += self._delete_in_batches(
+                lambda limit: list_expired_job_ids(
+                    now - max_age_days * 86400,
+                    exclude_statuses=FAILED_STATUSES,
+                    limit=limit,
+                )
+            )
+        if keep_failed_days is not None:
+            deleted += self._delete_in_batches(
+                lambda limit: list_expired_job_ids(
+                    now - keep_failed_days * 86400,
+                    statuses=FAILED_STATUSES,
+                    limit=limit,
+                )
+            )
+        if max_count is not None:
+            for flow_path in count_finished_jobs_per_flow(min_count=max_count):
+                deleted += self._delete_in_batches(
+                    lambda limit, flow_path=flow_path: list_excess_job_ids(
+                        flow_path, max_count, limit=limit
+                    )
+                )
+
+        # also gives back the pages freed by deletes through the api
+        freed = incremental_vacuum(self._policy["vacuum_pages"])
+        logging.info(
+            "Job retention: deleted %s jobs, freed %s pages in %.2f seconds",
+            deleted,
+            freed,
+            time.time() - now,
+        )
+        return deleted
+
+    def _delete_in_batches(self, list_job_ids):
+        """Delete the jobs returned by list_job_ids(limit) until there are none left."""
+        deleted = 0
+        while not self._stop.is_set():
+            job_ids = list_job_ids(self._policy["batch_size"])
+            if not job_ids:
+                break
+            deleted += delete_jobs_by_ids(job_ids)
+            # give the flows a chance to write between two batches
+            self._stop.wait(timeout=self._policy["batch_pause_seconds"])
+        return deleted
@@ -0,0 +1,89 @@
+import logging
+import threading
+
+import yaml
+
+from flow_processor.config import SECRETS_PATH
+from flow_processor.exceptions import BadSecretException, SecretNotFoundException
+from flow_processor.secret_factory import SecretFactory
+from flow_processor.utils import file_signature
+
+# secret types that resolve to the same value as long as secrets.yml is unchanged
+STATIC_SECRET_TYPES = ("credential", "token", "api-key")
+
+
+class SecretStore:
+    """
+    Process-wide registry of the secrets defined in secrets.yml.
+
+    The file is loaded once and reloaded when its mtime or size changes.
+    Secret definitions are indexed by name, and the resolved value of static
+    secret types is cached until the next reload. Dynamic secrets (e.g.
+    hashicorp-vault) are resolved on every call and rely on their own cache.
+    """
+
+    _definitions = {}
+    _resolved = {}
+    _signature = None
+    _lock = threading.Lock()
+    _hits = 0
+    _misses = 0
+
+    @classmethod
+    def get(cls, name):
+        """Return the resolved secret with the given name."""
+        with cls._lock:
+            cls._refresh()
+            if name in cls._resolved:
+                cls._hits += 1
+                return cls._resolved[name]
+            cls._misses += 1
+            secret_def = cls._definitions.get(name)
+
+        if not secret_def:
+            raise SecretNotFoundException(f"Secret {name} not found")
+
+        secret = SecretFactory.load(secret_def)
+
+        if secret_def.get("type", "credential") in STATIC_SECRET_TYPES:
+            with cls._lock:
+                # only cache if the file was not reloaded in the meantime
+                if cls._definitions.get(name) is secret_def:
+                    cls._resolved[name] = secret
+        return secret
+
+    @classmethod
+    def stats(cls):
+        """Return the cache counters of the resolved secrets."""
+        with cls._lock:
+            return {"hits": cls._hits, "misses": cls._misses, "size": len(cls._resolved)}
+
+    @classmethod
+    def reload(cls):
+        """Force a reload of the secrets file on the next lookup."""
+        with cls._lock:
+            cls._signature = None
+
+    @classmethod
+    def _refresh(cls):
+        """Reload the secrets file if it changed, must be called with the lock held."""
+        try:
+            signature = file_signature(SECRETS_PATH)
+        except FileNotFoundError:
+            if cls._signature != "missing":
+                logging.warning("Secrets file %s not found", SECRETS_PATH)
+            cls._definitions, cls._resolved, cls._signature = {}, {}, "missing"
+            return
+
+        if signature == cls._signature:
+            return
+
+        logging.info("Loading secrets from %s", SECRETS_PATH)
+        with open(SECRETS_PATH, "r") as file:
+            secret_defs = yaml.safe_load(file) or []
+        if not isinstance(secret_defs, list):
+            raise BadSecretException(f"Secrets file {SECRETS_PATH} must contain a list")
+
+        cls._definitions = {s["name"]: s for s in secret_defs if "name" in s}
+        cls._resolved = {}
+        cls._signature = signature
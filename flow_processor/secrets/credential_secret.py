@@ -12,6 +12,6 @@ class CredentialSecret(Secret):
     def load(self):
         if not self._username or not self._password:
             raise BadSecretException(
-                f"Credential secret '{self.name}' missing username or password"
+                f"Credential secret '{self._name}' missing username or password"
             )
         return {"username": self._username, "password": self._password}
@@ -1,9 +1,8 @@
 import time
 
-import requests
-
 from flow_processor.config import HASHICORP_VAULT_CACHE_TTL, HASHICORP_VAULT_TOKEN
 from flow_processor.exceptions import BadSecretException
+from flow_processor.http_pool import SessionPool
 
 from ..secret import Secret
 
@@ -40,7 +39,9 @@ class HashicorpVaultSecret(Secret):
             )
 
         headers = {"X-Vault-Token": token}
-        response = requests.get(self._uri, headers=headers, verify=False)
+        response = SessionPool.get(self._uri).get(
+            self._uri, headers=headers, verify=False
+        )
         if not response.ok:
             raise BadSecretException(
                 f"Failed to fetch secret '{self._name}' from Hashicorp Vault: {response.text}"
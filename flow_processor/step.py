@@ -1,22 +1,33 @@
+import asyncio
 import logging
+import time
 
-from flow_processor.exceptions import SecretNotFoundException
-from flow_processor.secret_factory import SecretFactory
-from flow_processor.utils import apply_jinja2
+from flow_processor.async_engine import StopEvent, offload
+from flow_processor.secret_store import SecretStore
+from flow_processor.utils import apply_jinja2, apply_jq_filter
 
 
 class Step:
-    """Base class for all steps in the flow."""
+    """Base class for all steps in the flow.
 
-    def __init__(self, step, flow):
+    The configuration of a step is validated (validate) and its expressions are
+    compiled (templates, jq_expressions) once, when the flow plan is compiled.
+    A step object is created once per flow run, bind() prepares it for every visit.
+    In the async engine the steps run with process_async, see async_engine.
+    """
+
+    def __init__(self, step, flow, compiled=None):
         self._name = step.get("name")
         self._type = step.get("type")
         self._flow = flow
         self._data = {}
         self._result_key = step.get("result_key", self._name)
         self._step = step  # Store the original step dictionary for internal use
+        self._compiled = compiled  # the compiled step of the flow plan, if any
         self._jq_expression = step.get("jq_expression", None)
         self._when = step.get("when", [])  # List of Jinja2 expressions
+        self._when_templates = [f"{{{{ {condition} }}}}" for condition in self._when]
+        self._metrics = {}  # step specific metrics for the timings (bytes, items, ...)
         self._representation = (
             f"{self._flow._representation}[{self._name} // {self._type}]"
         )
@@ -24,18 +35,54 @@ class Step:
     def __repr__(self):
         return f"{self._representation}"
 
+    @classmethod
+    def validate(cls, step):
+        """Check the step configuration, raises an AssertionError if it is invalid."""
+        assert isinstance(step.get("when", []), list), "when must be a list of conditions"
+        assert isinstance(step.get("ignore_errors", []), list), (
+            "ignore_errors must be a list of regexes"
+        )
+
+    @classmethod
+    def templates(cls, step):
+        """Return the jinja2 templates of the step configuration, compiled in the flow plan."""
+        return [f"{{{{ {condition} }}}}" for condition in step.get("when", [])]
+
+    @classmethod
+    def jq_expressions(cls, step):
+        """Return the jq expressions of the step configuration, compiled in the flow plan."""
+        return [step["jq_expression"]] if step.get("jq_expression") else []
+
+    def bind(self):
+        """Prepare the step for a visit, subclasses read their input from the flow data here."""
+        self._data = {}
+        self._metrics = {}
+
+    def _render(self, template, data=None):
+        """Render a template of the step configuration with the flow data."""
+        if self._compiled is not None:
+            template = self._compiled.templates.get(template, template)
+        return apply_jinja2(template, self._flow._data if data is None else data)
+
+    def _jq(self, data, expression):
+        """Apply a jq expression of the step configuration."""
+        if self._compiled is not None:
+            expression = self._compiled.jq_programs.get(expression, expression)
+        return apply_jq_filter(data, expression)
+
     def _patch(self):
         """Patch the data with the given key."""
         self._flow._data[self._result_key] = self._data
+        self._flow.data_changed(self._result_key)
 
     def _evaluate_when(self):
         """Evaluate the 'when' conditions."""
         if not self._when:  # If no 'when' property, always execute
             return True
 
-        for condition in self._when:
+        for condition, template in zip(self._when, self._when_templates):
             logging.debug("Evaluating condition: {{ %s }}", condition)
-            result = apply_jinja2(f"{{{{ {condition} }}}}", self._flow._data)
+            result = self._render(template)
             logging.debug("Condition result: %s", result)
             if not result.lower() in [
                 "true",
@@ -54,25 +101,55 @@ class Step:
 
     def process(self):
         """Process the step."""
-        from flow_processor.utils import apply_jq_filter
-
         # THIS IS RAN AFTER THE SUBCLASS PROCESS METHOD
         # Here we just patch the data with the result key
 
         # An optional jq filter in the step itself, because it's often enough to filter the data
         if self._jq_expression:
-            self._data = apply_jq_filter(self._data, self._jq_expression)
+            self._data = self._jq(self._data, self._jq_expression)
 
         self._patch()
         # Return the result if needed
         return self._data
 
+    async def process_async(self, ignore_when=False):
+        """Process the step in the async engine.
+
+        By default the step is cpu bound (jq, jinja, ...) and runs in the offload pool,
+        the I/O bound steps await on the event loop instead.
+        """
+        return await offload(self.process, ignore_when)
+
+    async def _post_process_async(self):
+        """The post processing of process() for an async step, a jq filter is offloaded."""
+        if self._jq_expression:
+            return await offload(Step.process, self)
+        return Step.process(self)
+
+    def _wait(self, seconds):
+        """Wait for some seconds, return True if the flow was stopped in the meantime."""
+        stop_event = self._flow._stop_event
+        if stop_event is None:
+            time.sleep(seconds)
+            return False
+        return stop_event.wait(seconds)
+
+    async def _wait_async(self, seconds):
+        """Wait for some seconds on the event loop, return True if the flow was stopped in the meantime."""
+        stop_event = self._flow._stop_event
+        if stop_event is None:
+            await asyncio.sleep(seconds)
+            return False
+        if isinstance(stop_event, StopEvent):
+            return await stop_event.wait_async(seconds)
+        # a plain threading.Event can't wake up a coroutine, check it every second
+        deadline = time.monotonic() + seconds
+        while not stop_event.is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(min(1, deadline - time.monotonic()))
+        return stop_event.is_set()
+
     def _get_secret(self, name):
-        secret_def = next((s for s in self._flow._secrets if s["name"] == name), None)
-        if not secret_def:
-            raise SecretNotFoundException(f"Secret {name} not found")
-        secret = SecretFactory.load(secret_def)
-        return secret
+        return SecretStore.get(name)
 
     def _get_data_by_key(self, key=None):
         """Retrieve data by key."""
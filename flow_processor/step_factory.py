@@ -12,41 +12,42 @@ from .steps import (
     SwitchStep,
     GotoStep,
     SetFactStep,
+    WaitUntilStep,
 )
 
+# the step class of every step type
+STEP_TYPES = {
+    "file": FileStep,
+    "rest": RestStep,
+    "jq": JqStep,
+    "jinja": JinjaStep,
+    "flow_loop": FlowLoopStep,
+    "flow": FlowStep,
+    "jira_names_merge": JiraNamesMergeStep,
+    "switch": SwitchStep,
+    "debug": DebugStep,
+    "sleep": SleepStep,
+    "exit": ExitStep,
+    "goto": GotoStep,
+    "set_fact": SetFactStep,
+    "wait_until": WaitUntilStep,
+}
+
+
+def get_step_class(step_type):
+    """Return the step class of a step type."""
+    step_class = STEP_TYPES.get(step_type)
+    if step_class is None:
+        raise Exception(f"Unsupported step type: {step_type}")
+    return step_class
+
 
 # Factory function
-def create_step(step, flow):
-    """Factory function to create a step based on its type."""
-    step_type = step.get("type")
-    match step_type:
-        case "file":
-            return FileStep(step, flow)
-        case "rest":
-            return RestStep(step, flow)
-        case "jq":
-            return JqStep(step, flow)
-        case "jinja":
-            return JinjaStep(step, flow)
-        case "flow_loop":
-            return FlowLoopStep(step, flow)
-        case "flow":
-            return FlowStep(step, flow)
-        case "jira_names_merge":
-            return JiraNamesMergeStep(step, flow)
-        case "switch":
-            return SwitchStep(step, flow)
-        case "debug":
-            return DebugStep(step, flow)
-        case "sleep":
-            return SleepStep(step, flow)
-        case "exit":
-            return ExitStep(step, flow)
-        case "switch":
-            return SwitchStep(step, flow)
-        case "goto":
-            return GotoStep(step, flow)
-        case "set_fact":
-            return SetFactStep(step, flow)
-        case _:
-            raise Exception(f"Unsupported step type: {step_type}")
+def create_step(step, flow, compiled=None):
+    """Factory function to create a step based on its type.
+
+    With the compiled step of the flow plan, the step uses its precompiled expressions.
+    """
+    if compiled is not None:
+        return compiled.step_class(step, flow, compiled)
+    return get_step_class(step.get("type"))(step, flow)
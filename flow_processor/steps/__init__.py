@@ -11,6 +11,7 @@ from .sleep_step import SleepStep
 from .switch_step import SwitchStep
 from .goto_step import GotoStep
 from .set_fact_step import SetFactStep
+from .wait_until_step import WaitUntilStep
 
 __all__ = [
     "DebugStep",
@@ -26,4 +27,5 @@ __all__ = [
     "SwitchStep",
     "GotoStep",
     "SetFactStep",
+    "WaitUntilStep",
 ]
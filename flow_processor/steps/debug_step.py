@@ -6,12 +6,20 @@ from ..step import Step
 class DebugStep(Step):
     """Subclass for debug operations."""
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
-        assert "debug" in step, "Debug configuration is required"
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._debug = step.get("debug")
         self._type = self._debug.get("type", "yaml")
         self._data_key = self._debug.get("data_key", "")
+
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        assert "debug" in step, "Debug configuration is required"
+        assert isinstance(step["debug"], dict), "Debug configuration must be a dictionary"
+
+    def bind(self):
+        super().bind()
         if self._data_key == "":
             self._data = self._flow._data
         else:
@@ -7,13 +7,17 @@ from ..step import Step
 class ExitStep(Step):
     """Subclass for exit operations."""
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
-        assert "exit" in step, "exit property is required"
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._exit = step.get("exit", {})
-        assert "message" in self._exit, "exit message is required"
         self._message = self._exit.get("message", "")
 
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        assert "exit" in step, "exit property is required"
+        assert "message" in step["exit"], "exit message is required"
+
     def process(self, ignore_when=False):
         """Process the exit step."""
 
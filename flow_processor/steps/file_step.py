@@ -5,25 +5,32 @@ import os
 import yaml
 
 from flow_processor.config import DATA_PATH
-from flow_processor.utils import apply_jinja2
-
 from ..step import Step
 
 
 class FileStep(Step):
     """Subclass for file operations."""
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
-        assert "file" in step, "File configuration is required"
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._file = step.get("file")
-        assert "path" in self._file, "File path is required"
-        self._file_path = os.path.join(
-            DATA_PATH, apply_jinja2(self._file.get("path"), self._flow._data)
-        )
         self._file_type = self._file.get("type", "yaml")
         self._file_mode = self._file.get("mode", "read")
 
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        assert "file" in step, "File configuration is required"
+        assert "path" in step["file"], "File path is required"
+
+    @classmethod
+    def templates(cls, step):
+        return super().templates(step) + [step["file"]["path"]]
+
+    def bind(self):
+        super().bind()
+        self._file_path = os.path.join(DATA_PATH, self._render(self._file.get("path")))
+
     def process(self, ignore_when=False):
         """Process the file step."""
 
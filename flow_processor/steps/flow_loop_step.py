@@ -1,23 +1,87 @@
 import asyncio
+import concurrent.futures
+import contextvars
 import logging
 import os
+import threading
+import time
 
-from flow_processor.config import FLOWS_PATH
+from flow_processor.config import FLOW_LOOP_MAX_CONCURRENCY, FLOW_LOOP_MAX_WORKERS, FLOWS_PATH
+from flow_processor.timings import merge_timings, new_timings
 
 from ..step import Step
 
 
+class RateLimiter:
+    """Spread the start of items evenly, at most `rate` items per second."""
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate
+        self._next_start = None
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reserve the next start, return the seconds to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            start = now if self._next_start is None else max(now, self._next_start)
+            self._next_start = start + self._interval
+            return start - now
+
+
 class FlowLoopStep(Step):
-    """Subclass for flow loop operations."""
+    """Subclass for flow loop operations.
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
-        assert "flow_loop" in step, "Flow loop configuration is required"
+    In the thread engine the items run on a pool of FLOW_LOOP_MAX_WORKERS threads shared
+    by all flow loops, in the async engine they are coroutines on the event loop.
+    """
+
+    _executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=FLOW_LOOP_MAX_WORKERS, thread_name_prefix="flow_loop"
+    )
+
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._flow_loop = step.get("flow_loop")
-        assert "path" in self._flow_loop, "Flow path is required"
         self._path = os.path.join(FLOWS_PATH, self._flow_loop.get("path"))
-        assert "data_key" in self._flow_loop, "Data key is required"
         self._data_key = self._flow_loop.get("data_key")
+        self._max_concurrency = self._flow_loop.get(
+            "max_concurrency", FLOW_LOOP_MAX_CONCURRENCY
+        )
+        self._rate_limit = self._flow_loop.get("rate_limit", None)
+        self._chunk_size = self._flow_loop.get("chunk_size", None)
+        # what to keep of each item, by default the full data and status of the subflow
+        self._item_result_key = self._flow_loop.get("item_result_key", None)
+        self._item_jq_expression = self._flow_loop.get("item_jq_expression", None)
+        self._discard_results = self._flow_loop.get("discard_results", False)
+
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        assert "flow_loop" in step, "Flow loop configuration is required"
+        flow_loop = step["flow_loop"]
+        assert "path" in flow_loop, "Flow path is required"
+        assert "data_key" in flow_loop, "Data key is required"
+        max_concurrency = flow_loop.get("max_concurrency", FLOW_LOOP_MAX_CONCURRENCY)
+        assert (
+            isinstance(max_concurrency, int) and max_concurrency > 0
+        ), "max_concurrency must be a positive integer"
+        rate_limit = flow_loop.get("rate_limit", None)
+        assert rate_limit is None or (
+            isinstance(rate_limit, (int, float)) and rate_limit > 0
+        ), "rate_limit must be a positive number (items per second)"
+        chunk_size = flow_loop.get("chunk_size", None)
+        assert chunk_size is None or (
+            isinstance(chunk_size, int) and chunk_size > 0
+        ), "chunk_size must be a positive integer"
+
+    @classmethod
+    def jq_expressions(cls, step):
+        expression = step["flow_loop"].get("item_jq_expression")
+        return super().jq_expressions(step) + ([expression] if expression else [])
+
+    def bind(self):
+        super().bind()
         self._list = self._flow._data.get(self._data_key)
         assert isinstance(self._list, list), "Data key must produce a list"
 
@@ -28,24 +92,177 @@ class FlowLoopStep(Step):
         if not enabled:
             return
 
-        logging.info("%s -> %s", self._representation, self._path)
+        self._log_start()
         from flow_processor.flow import Flow  # recursive import
 
         # Load the flow and process it
-        self._data = []
+        results = []
+        summary = {"count": 0, "success": 0, "failed": 0, "exit": 0, "errors": []}
 
-        async def process_item(index, item):
-            return await asyncio.to_thread(Flow(self._path, item, index + 1).process)
+        rate_limiter = RateLimiter(self._rate_limit) if self._rate_limit else None
 
-        async def process_all():
-            tasks = [process_item(index, item) for index, item in enumerate(self._list)]
-            self._data = await asyncio.gather(*tasks)
+        def process_item(index, item):
+            if rate_limiter:
+                # a stopped flow wakes up at once, its items stop without running a step
+                self._wait(rate_limiter.reserve())
+            # the items stop with the parent flow
+            return Flow(self._path, item, index + 1).process(stop_event=self._flow._stop_event)
 
-        asyncio.run(process_all())
-
-        # loop self._data, extend __errors__ to the flow._data __errors__
-        for item in self._data:
-            if "__errors__" in item:
-                self._flow._data["__errors__"].extend(item["__errors__"])
+        for start, chunk in self._chunks(results, summary):
+            self._chunk_done(start, self._run_chunk(process_item, start, chunk), results, summary)
+        self._metrics["items"] = len(self._list)
 
+        self._data = summary if self._discard_results else results
         return super().process()
+
+    async def process_async(self, ignore_when=False):
+        """Process the items as coroutines on the event loop, in the async engine."""
+        enabled = super().pre_process(ignore_when)
+        if not enabled:
+            return
+
+        self._log_start()
+        from flow_processor.flow import Flow  # recursive import
+
+        results = []
+        summary = {"count": 0, "success": 0, "failed": 0, "exit": 0, "errors": []}
+
+        def process_item(index, item):
+            return Flow(self._path, item, index + 1).process_async(
+                stop_event=self._flow._stop_event
+            )
+
+        await self._process_items(process_item, results, summary)
+        self._metrics["items"] = len(self._list)
+
+        self._data = summary if self._discard_results else results
+        return await self._post_process_async()
+
+    def _log_start(self):
+        logging.info(
+            "%s -> %s (max_concurrency: %s, rate_limit: %s)",
+            self._representation,
+            self._path,
+            self._max_concurrency,
+            self._rate_limit,
+        )
+
+    def _chunks(self, results, summary):
+        """Yield the index of the first item and the items of every chunk still to process."""
+        chunk_size = self._chunk_size or len(self._list) or 1
+
+        # a resumed job goes on after the last chunk of the loop it finished
+        first = 0
+        progress = self._flow.take_loop_progress(self._name, len(self._list))
+        if progress:
+            first = progress["done"]
+            results.extend(progress["results"])
+            summary.update(progress["summary"])
+            logging.info(
+                "%s -> resuming after %s of %s items", self._representation, first, len(self._list)
+            )
+
+        for start in range(first, len(self._list), chunk_size):
+            yield start, self._list[start : start + chunk_size]
+
+    def _chunk_done(self, start, chunk_results, results, summary):
+        """Collect the results of a chunk, in the order of the items."""
+        # only the projected result of each item is kept
+        collected = len(results)
+        for offset, item_result in enumerate(chunk_results):
+            self._collect(start + offset + 1, item_result, results, summary)
+        done = start + len(chunk_results)
+        if done < len(self._list):
+            # the progress of a resumable job, only the results of this chunk
+            self._flow.checkpoint_loop(
+                self._name, done, len(self._list), results[collected:], summary
+            )
+
+    def _run_chunk(self, process_item, start, chunk):
+        """Process the items of a chunk on the shared pool, never more than max_concurrency at once.
+
+        The calling thread processes items too and waits only for the items already running
+        on the pool, so the flow loops of child flows can't exhaust the pool and dead lock.
+        """
+        chunk_results = [None] * len(chunk)
+        items = iter(enumerate(chunk))
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    next_item = next(items, None)
+                if next_item is None:
+                    return
+                offset, item = next_item
+                chunk_results[offset] = process_item(start + offset, item)
+
+        # the helpers run in a copy of the current context, keeps the job id in the logs
+        helpers = [
+            self._executor.submit(contextvars.copy_context().run, work)
+            for _ in range(min(self._max_concurrency, len(chunk)) - 1)
+        ]
+        try:
+            work()
+        finally:
+            # the helpers not started yet have nothing left to do, wait for the running ones
+            helpers = [helper for helper in helpers if not helper.cancel()]
+            concurrent.futures.wait(helpers)
+        for helper in helpers:
+            helper.result()
+        return chunk_results
+
+    async def _process_items(self, process_item, results, summary):
+        """Process the list chunk by chunk, process_item(index, item) returns the awaitable of an item."""
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+        rate_limiter = RateLimiter(self._rate_limit) if self._rate_limit else None
+
+        async def limited(index, item):
+            async with semaphore:
+                if rate_limiter:
+                    await self._wait_async(rate_limiter.reserve())
+                return await process_item(index, item)
+
+        for start, chunk in self._chunks(results, summary):
+            tasks = [limited(start + offset, item) for offset, item in enumerate(chunk)]
+            self._chunk_done(start, await asyncio.gather(*tasks), results, summary)
+
+    def _collect(self, loop_index, item_result, results, summary):
+        """Keep the (projected) result of an item and count its outcome."""
+        data, status = item_result
+        errors = data.get("__errors__", [])
+
+        # the timings of all items are aggregated in the timings of this step
+        timings = data.pop("__timings__", None)
+        if timings:
+            self._metrics["children"] = merge_timings(
+                self._metrics.get("children") or new_timings(), timings
+            )
+
+        # extend __errors__ to the flow._data __errors__
+        self._flow._data["__errors__"].extend(errors)
+
+        status_type = status.get("type")
+        summary["count"] += 1
+        if status_type in summary:
+            summary[status_type] += 1
+        if errors or status_type == "failed":
+            summary["errors"].append(
+                {
+                    "loop_index": loop_index,
+                    "status": status_type,
+                    "message": status.get("message"),
+                    "errors": errors,
+                }
+            )
+
+        if self._discard_results:
+            return
+        if not self._item_result_key and not self._item_jq_expression:
+            results.append(item_result)
+            return
+        if self._item_result_key:
+            data = data.get(self._item_result_key)
+        if self._item_jq_expression:
+            data = self._jq(data, self._item_jq_expression)
+        results.append(data)
@@ -10,27 +10,38 @@ class FlowStep(Step):
     """
     FlowStep is a subclass of Step that represents a specific step in a flow operation.
     Attributes:
-        _flow (dict): The flow configuration dictionary extracted from the step.
+        _flow_config (dict): The flow configuration dictionary extracted from the step.
         _path (str): The relative path of the flow, derived from the flow configuration.
         _data_key (str): The key used to retrieve specific data from the flow configuration.
         _payload (Any): The payload data associated with the specified data key in the flow.
     Methods:
-        __init__(step, flow_parent):
+        __init__(step, flow_parent, compiled):
             Initializes the FlowStep instance with the given step configuration and parent flow.
+        validate(step):
             Validates the presence of required flow configuration keys.
+        bind():
+            Takes the payload of the child flow from the parent flow data.
         process():
             Processes the flow step by invoking the Flow processor with the specified path and payload.
             Logs the operation and invokes the parent class's process method.
     """
 
-    def __init__(self, step, flow_parent):
-        super().__init__(step, flow_parent)
+    def __init__(self, step, flow_parent, compiled=None):
+        super().__init__(step, flow_parent, compiled)
+        # self._flow is the parent flow, keep the step configuration apart
+        self._flow_config = step.get("flow")
+        self._path = os.path.join(FLOWS_PATH, self._flow_config.get("path"))
+        self._data_key = self._flow_config.get("data_key")
+
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
         assert "flow" in step, "Flow configuration is required"
-        self._flow = step.get("flow")
-        assert "path" in self._flow, "Flow path is required"
-        self._path = os.path.join(FLOWS_PATH, self._flow.get("path"))
-        assert "data_key" in self._flow, "Data key is required"
-        self._data_key = self._flow.get("data_key")
+        assert "path" in step["flow"], "Flow path is required"
+        assert "data_key" in step["flow"], "Data key is required"
+
+    def bind(self):
+        super().bind()
         self._payload = self._flow._data.get(self._data_key)
 
     def process(self, ignore_when=False):
@@ -41,8 +52,32 @@ class FlowStep(Step):
         if not enabled:
             return
 
-        from flow_processor import Flow  # recursive import
+        from flow_processor.flow import Flow  # recursive import
 
         logging.info("%s -> %s", self._representation, self._path)
-        self._data = Flow(self._path, self._payload).process()
+        data, status = Flow(
+            self._path, self._payload, job_id=self._flow._data.get("__job_id__")
+        ).process(stop_event=self._flow._stop_event)
+        self._child_flow_done(data, status)
         return super().process()
+
+    async def process_async(self, ignore_when=False):
+        """Process the child flow as a coroutine, in the async engine."""
+        enabled = super().pre_process(ignore_when)
+        if not enabled:
+            return
+
+        from flow_processor.flow import Flow  # recursive import
+
+        logging.info("%s -> %s", self._representation, self._path)
+        data, status = await Flow(
+            self._path, self._payload, job_id=self._flow._data.get("__job_id__")
+        ).process_async(stop_event=self._flow._stop_event)
+        self._child_flow_done(data, status)
+        return await self._post_process_async()
+
+    def _child_flow_done(self, data, status):
+        """Keep the data and the status of the child flow, like the items of a flow_loop."""
+        # the timings of the child flow are nested in the timings of this step
+        self._metrics["children"] = data.pop("__timings__", None)
+        self._data = (data, status)
@@ -1,18 +1,29 @@
 
 from ..step import Step
 import logging
-from flow_processor.utils import apply_jinja2
 
 class GotoStep(Step):
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
-        assert "goto" in step, "Goto configuration is required"
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._goto = step.get("goto")
-        self._step_name = self._goto.get("step_name")
-        assert isinstance(self._step_name, str), "Goto step name must be a string"
-        assert self._step_name, "Goto step name cannot be empty"
-        self._step_name = apply_jinja2(self._step_name, self._flow._data)
+        self._step_name_template = self._goto.get("step_name")
+
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        assert "goto" in step, "Goto configuration is required"
+        step_name = step["goto"].get("step_name")
+        assert isinstance(step_name, str), "Goto step name must be a string"
+        assert step_name, "Goto step name cannot be empty"
+
+    @classmethod
+    def templates(cls, step):
+        return super().templates(step) + [step["goto"]["step_name"]]
+
+    def bind(self):
+        super().bind()
+        self._step_name = self._render(self._step_name_template)
 
     def process(self):
         # Just return the step name to jump to
@@ -11,20 +11,27 @@ from ..step import Step
 class JinjaStep(Step):
     """Subclass for jinja operations."""
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
-        assert "jinja" in step, "Jinja configuration is required"
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._jinja = step.get("jinja")
-        assert "path" in self._jinja, "Jinja path is required"
         self._path = self._jinja.get("path")
         self._parse = self._jinja.get("parse", None)
         self._data_key = self._jinja.get("data_key", None)
-        if self._data_key:
-            self._data = self._flow._data.get(self._data_key)
 
         # debug logging
         logging.debug("JinjaStep initialized with path: %s", self._path)
 
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        assert "jinja" in step, "Jinja configuration is required"
+        assert "path" in step["jinja"], "Jinja path is required"
+
+    def bind(self):
+        super().bind()
+        if self._data_key:
+            self._data = self._flow._data.get(self._data_key)
+
     def process(self, ignore_when=False):
         """Process the jinja step."""
 
@@ -8,12 +8,16 @@ from ..step import Step
 class JiraNamesMergeStep(Step):
     """Subclass for file operations."""
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
-        assert "jira_names_merge" in step, "Jira names merge configuration is required"
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._jira_names_merge = step.get("jira_names_merge")
         self._list_key = self._jira_names_merge.get("list_key", "issues")
-        assert "data_key" in self._jira_names_merge, "issues key is required"
+
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        assert "jira_names_merge" in step, "Jira names merge configuration is required"
+        assert "data_key" in step["jira_names_merge"], "issues key is required"
 
     def process(self, ignore_when=False):
         """Process the Jira names merge step."""
@@ -1,21 +1,30 @@
 import logging
 
-from flow_processor.utils import apply_jq_filter
-
 from ..step import Step
 
 
 class JqStep(Step):
     """Subclass for jq operations."""
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
+        self._jq_config = step.get("jq")
+        self._expression = self._jq_config.get("expression")
+        self._data_key = self._jq_config.get("data_key")
+
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
         assert "jq" in step, "Jq configuration is required"
-        self._jq = step.get("jq")
-        assert "expression" in self._jq, "Jq expression is required"
-        assert "data_key" in self._jq, "Data key is required"
-        self._expression = self._jq.get("expression")
-        self._data_key = self._jq.get("data_key")
+        assert "expression" in step["jq"], "Jq expression is required"
+        assert "data_key" in step["jq"], "Data key is required"
+
+    @classmethod
+    def jq_expressions(cls, step):
+        return super().jq_expressions(step) + [step["jq"]["expression"]]
+
+    def bind(self):
+        super().bind()
         self._data = self._flow._data.get(self._data_key, {})
 
     def process(self, ignore_when=False):
@@ -27,5 +36,5 @@ class JqStep(Step):
             return
 
         logging.info("%s -> %s", self._representation, self._expression)
-        self._data = apply_jq_filter(self._data, self._expression)
+        self._data = self._jq(self._data, self._expression)
         return super().process()
@@ -1,11 +1,21 @@
+import asyncio
 import base64
+import concurrent.futures
+import contextvars
 import logging
+import time
+from urllib.parse import urljoin
 
-import requests
 import urllib3
 
+from flow_processor.async_engine import http_request
+from flow_processor.http_pool import SessionPool
+from flow_processor.metrics import REST_LATENCY
 from flow_processor.step import Step
-from flow_processor.utils import apply_jinja2
+
+PAGINATION_TYPES = ("offset", "link", "cursor")
+HTTP_METHODS = ("GET", "POST", "PUT", "DELETE", "PATCH")
+BODY_METHODS = ("POST", "PUT", "PATCH")  # the methods that send the body as json
 
 
 class RestStepException(Exception):
@@ -23,22 +33,64 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 class RestStep(Step):
     """Subclass for REST operations."""
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
-
-        # make sure the step is a REST step
-        assert "rest" in step, "REST configuration is required"
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._rest = step.get("rest")
-
-        # make sure the step has an uri, this is minimum
-        assert "uri" in self._rest, "URI is required"
-        self._uri = apply_jinja2(self._rest.get("uri"), self._flow._data)
+        # the uri, headers and body are bound to the flow data on every visit
+        self._uri = self._rest.get("uri")
+        self._headers = {}
+        self._body = {}
         self._method = self._rest.get("method", "GET").upper()
-        self._headers = self._rest.get("headers", {})
         self._query = self._rest.get("query", {})
         self._data_key = self._rest.get("data_key", None)
         self._authentication = self._rest.get("authentication", None)
 
+        # optional pagination, all pages are fetched and their items concatenated
+        self._pagination = self._rest.get("pagination", None)
+        if self._pagination:
+            self._pagination_type = self._pagination.get("type", "offset")
+            self._page_items = self._pagination.get("items", None)
+            self._page_size = self._pagination.get("page_size", 100)
+            self._max_pages = self._pagination.get("max_pages", 1000)
+            self._prefetch = self._pagination.get("prefetch", False)
+
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        # make sure the step is a REST step
+        assert "rest" in step, "REST configuration is required"
+        rest = step["rest"]
+
+        # make sure the step has an uri, this is minimum
+        assert "uri" in rest, "URI is required"
+        pagination = rest.get("pagination", None)
+        if pagination:
+            assert isinstance(pagination, dict), "Pagination must be a dictionary"
+            assert pagination.get("type", "offset") in PAGINATION_TYPES, (
+                f"Pagination type must be one of {', '.join(PAGINATION_TYPES)}"
+            )
+            if pagination.get("type") == "cursor":
+                assert "next" in pagination, (
+                    "Cursor pagination requires a 'next' jq expression"
+                )
+
+    @classmethod
+    def templates(cls, step):
+        return super().templates(step) + [step["rest"]["uri"]]
+
+    @classmethod
+    def jq_expressions(cls, step):
+        pagination = step["rest"].get("pagination") or {}
+        return super().jq_expressions(step) + [
+            pagination[key] for key in ("items", "next") if pagination.get(key)
+        ]
+
+    def bind(self):
+        super().bind()
+        self._uri = self._render(self._rest.get("uri"))
+        # copy, the step definition is shared between flow instances (flow cache)
+        self._headers = dict(self._rest.get("headers", {}))
+
         # process the query parameters, add ? and & and uri encode the values, use python urllib.parse
         if self._query:
             from urllib.parse import urlencode
@@ -69,42 +121,211 @@ class RestStep(Step):
         logging.debug("%s -> %s %s", self._representation, self._method, self._uri)
         logging.info(self._representation)
 
-        # Make the REST request
-        response = self._make_rest_request()
+        if self._pagination:
+            self._data = self._fetch_pages()
+        else:
+            # Make the REST request
+            response = self._make_rest_request()
+            self._count_bytes(response)
+            self._check_response(response)
+            self._data = response.json()
+        return super().process()
+
+    async def process_async(self, ignore_when=False):
+        """Process the REST step on the event loop, in the async engine."""
+        enabled = super().pre_process(ignore_when)
+        if not enabled:
+            return
+
+        logging.debug("%s -> %s %s", self._representation, self._method, self._uri)
+        logging.info(self._representation)
+
+        if self._pagination:
+            self._data = await self._fetch_pages_async()
+        else:
+            response = await self._make_rest_request_async()
+            self._count_bytes(response)
+            self._check_response(response)
+            self._data = response.json()
+        return await self._post_process_async()
+
+    def _count_bytes(self, response):
+        """Add the size of a response body to the step metrics."""
+        self._metrics["bytes"] = self._metrics.get("bytes", 0) + len(response.content)
+
+    def _check_response(self, response):
+        """Raise a RestStepException if the response is not successful."""
         if 200 <= response.status_code < 300:
-            pass
+            return
+
+        # if the response contained data, log it
+        if response.content:
+            logging.error(
+                "%s REST request failed with status code %s: %r",
+                self._representation,
+                response.status_code,
+                response.content,
+            )
+            try:
+                response_content = response.json()
+            except ValueError:
+                response_content = (
+                    response.content
+                )  # Fallback to raw content if not JSON
+            raise RestStepException(
+                message="REST request failed",
+                status_code=response.status_code,
+                response_content=response_content,
+            )
         else:
-            # if the response contained data, log it
-            if response.content:
-                logging.error(
-                    "%s REST request failed with status code %s: %r",
-                    self._representation,
-                    response.status_code,
-                    response.content,
-                )
-                try:
-                    response_content = response.json()
-                except ValueError:
-                    response_content = (
-                        response.content
-                    )  # Fallback to raw content if not JSON
-                raise RestStepException(
-                    message="REST request failed",
-                    status_code=response.status_code,
-                    response_content=response_content,
-                )
-            else:
-                logging.error(
-                    "%s REST request failed with status code %s",
+            logging.error(
+                "%s REST request failed with status code %s",
+                self._representation,
+                response.status_code,
+            )
+            raise RestStepException(
+                message="REST request failed", status_code=response.status_code
+            )
+
+    def _fetch_pages(self):
+        """Fetch all pages of a paginated request and concatenate their items."""
+        offset = self._pagination.get("start", 0)
+        request = self._page_request(self._uri, offset)
+        items = []
+        pages = 0
+
+        # with prefetch, the next page is requested while the current one is processed
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as prefetcher:
+            prefetched = None
+            while request:
+                if prefetched:
+                    response = prefetched.result()
+                    prefetched = None
+                else:
+                    response = self._make_rest_request(*request)
+                pages += 1
+                next_request, offset = self._receive_page(response, request, offset)
+                if next_request and self._prefetch and pages < self._max_pages:
+                    # run in a copy of the current context, keeps the job id in the logs
+                    prefetched = prefetcher.submit(
+                        contextvars.copy_context().run,
+                        self._make_rest_request,
+                        *next_request,
+                    )
+
+                request = self._parse_page(response, request, next_request, items, pages)
+                if not request and prefetched:
+                    # the speculative request for a page past the end is not needed
+                    prefetched.cancel()
+                    prefetched = None
+
+        logging.info("%s -> %s items in %s pages", self._representation, len(items), pages)
+        return items
+
+    async def _fetch_pages_async(self):
+        """Fetch all pages of a paginated request on the event loop, like _fetch_pages."""
+        offset = self._pagination.get("start", 0)
+        request = self._page_request(self._uri, offset)
+        items = []
+        pages = 0
+
+        prefetched = None
+        try:
+            while request:
+                if prefetched:
+                    response = await prefetched
+                    prefetched = None
+                else:
+                    response = await self._make_rest_request_async(*request)
+                pages += 1
+                next_request, offset = self._receive_page(response, request, offset)
+                if next_request and self._prefetch and pages < self._max_pages:
+                    prefetched = asyncio.ensure_future(
+                        self._make_rest_request_async(*next_request)
+                    )
+
+                request = self._parse_page(response, request, next_request, items, pages)
+                if not request and prefetched:
+                    prefetched.cancel()
+                    prefetched = None
+        finally:
+            if prefetched:
+                prefetched.cancel()
+
+        logging.info("%s -> %s items in %s pages", self._representation, len(items), pages)
+        return items
+
+    def _receive_page(self, response, request, offset):
+        """Check the response of a page, return the next request if it is known before the body is parsed."""
+        self._count_bytes(response)
+        self._check_response(response)
+
+        # offset and link pagination know the next page before parsing the body
+        next_request = None
+        match self._pagination_type:
+            case "offset":
+                offset += self._page_size
+                next_request = self._page_request(self._uri, offset)
+            case "link":
+                next_url = response.links.get("next", {}).get("url")
+                if next_url:
+                    next_request = (urljoin(request[0], next_url), None)
+        return next_request, offset
+
+    def _parse_page(self, response, request, next_request, items, pages):
+        """Add the items of a page to the items, return the request of the next page (None for the last page)."""
+        page = response.json()
+        page_items = self._jq(page, self._page_items) if self._page_items else page
+        if page_items is None:
+            page_items = []
+        if not isinstance(page_items, list):
+            raise Exception(
+                f"Pagination items must produce a list, got {type(page_items).__name__}"
+            )
+        items.extend(page_items)
+        logging.debug(
+            "%s -> page %s, %s items", self._representation, pages, len(page_items)
+        )
+
+        match self._pagination_type:
+            case "offset":
+                if len(page_items) < self._page_size:
+                    next_request = None
+            case "cursor":
+                next_request = self._cursor_request(page, request)
+
+        if pages >= self._max_pages:
+            if next_request:
+                logging.warning(
+                    "%s -> stopped after max_pages (%s)",
                     self._representation,
-                    response.status_code,
-                )
-                raise RestStepException(
-                    message="REST request failed", status_code=response.status_code
+                    self._max_pages,
                 )
+            next_request = None
+        return next_request
 
-        self._data = response.json()
-        return super().process()
+    def _page_request(self, uri, offset):
+        """Return the (uri, params) of an offset page, or of the first page."""
+        if self._pagination_type != "offset":
+            return (uri, None)
+        return (
+            uri,
+            {
+                self._pagination.get("offset_param", "offset"): offset,
+                self._pagination.get("limit_param", "limit"): self._page_size,
+            },
+        )
+
+    def _cursor_request(self, page, request):
+        """Return the (uri, params) of the next cursor page, None if this was the last page."""
+        cursor = self._jq(page, self._pagination.get("next"))
+        if cursor in (None, "", False):
+            return None
+        cursor_param = self._pagination.get("cursor_param", None)
+        if cursor_param:
+            return (self._uri, {cursor_param: cursor})
+        # no cursor parameter, the cursor is the url of the next page
+        return (urljoin(request[0], str(cursor)), None)
 
     def _get_auth_headers(self):
         """Generate authentication headers."""
@@ -142,24 +363,55 @@ class RestStep(Step):
             case _:
                 raise Exception(f"Unsupported authentication type: {auth_type}")
 
-    def _make_rest_request(self):
+    async def _make_rest_request_async(self, uri=None, params=None):
+        """Make a REST request on the event loop."""
+        uri = uri or self._uri
+        if self._method not in HTTP_METHODS:
+            raise Exception(f"Unsupported HTTP method: {self._method}")
+        body = self._body if self._method in BODY_METHODS else None
+        start = time.perf_counter()
+        try:
+            return await http_request(self._method, uri, params, self._headers, body)
+        finally:
+            REST_LATENCY.observe(
+                time.perf_counter() - start,
+                host=SessionPool.base_url(uri),
+                method=self._method,
+            )
+
+    def _make_rest_request(self, uri=None, params=None):
         """Make a REST request."""
-        match self._method:
-            case "GET":
-                return requests.get(self._uri, headers=self._headers, verify=False)
-            case "POST":
-                return requests.post(
-                    self._uri, headers=self._headers, json=self._body, verify=False
-                )
-            case "PUT":
-                return requests.put(
-                    self._uri, headers=self._headers, json=self._body, verify=False
-                )
-            case "DELETE":
-                return requests.delete(self._uri, headers=self._headers, verify=False)
-            case "PATCH":
-                return requests.patch(
-                    self._uri, headers=self._headers, json=self._body, verify=False
-                )
-            case _:
-                raise Exception(f"Unsupported HTTP method: {self._method}")
+        uri = uri or self._uri
+        # pooled session, keeps the connection to the host alive between requests
+        session = SessionPool.get(uri)
+        start = time.perf_counter()
+        try:
+            match self._method:
+                case "GET":
+                    return session.get(
+                        uri, params=params, headers=self._headers, verify=False
+                    )
+                case "POST":
+                    return session.post(
+                        uri, params=params, headers=self._headers, json=self._body, verify=False
+                    )
+                case "PUT":
+                    return session.put(
+                        uri, params=params, headers=self._headers, json=self._body, verify=False
+                    )
+                case "DELETE":
+                    return session.delete(
+                        uri, params=params, headers=self._headers, verify=False
+                    )
+                case "PATCH":
+                    return session.patch(
+                        uri, params=params, headers=self._headers, json=self._body, verify=False
+                    )
+                case _:
+                    raise Exception(f"Unsupported HTTP method: {self._method}")
+        finally:
+            REST_LATENCY.observe(
+                time.perf_counter() - start,
+                host=SessionPool.base_url(uri),
+                method=self._method,
+            )
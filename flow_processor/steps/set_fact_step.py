@@ -1,17 +1,26 @@
 from ..step import Step
 import logging
-from flow_processor.utils import apply_jinja2
 
 class SetFactStep(Step):
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._set_fact = step.get("set_fact")
-        assert self._set_fact, "SetFact configuration is required"
-        assert isinstance(self._set_fact, dict), "SetFact must be a dictionary"
-        assert "value" in self._set_fact, "SetFact configuration requires a 'value' property"
         self._value = self._set_fact.get("value")
-        assert self._value, "SetFact value cannot be empty"
+
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        set_fact = step.get("set_fact")
+        assert set_fact, "SetFact configuration is required"
+        assert isinstance(set_fact, dict), "SetFact must be a dictionary"
+        assert "value" in set_fact, "SetFact configuration requires a 'value' property"
+        assert set_fact["value"], "SetFact value cannot be empty"
+
+    @classmethod
+    def templates(cls, step):
+        value = step["set_fact"]["value"]
+        return super().templates(step) + ([value] if isinstance(value, str) else [])
 
     def process(self):
         # No return, just set the fact (assume self.flow has a facts dict)
@@ -26,5 +35,5 @@ class SetFactStep(Step):
             return
 
         logging.info("%s -> %s", self._representation, self._value)
-        self._data = apply_jinja2(self._value, self._flow._data)
+        self._data = self._render(self._value)
         return super().process()
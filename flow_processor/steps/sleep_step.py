@@ -1,18 +1,34 @@
 import logging
+import time
+
+from flow_processor.config import SLEEP_DEFER_SECONDS
 
 from ..step import Step
 
 
 class SleepStep(Step):
-    """Subclass for sleep operations."""
+    """Subclass for sleep operations.
 
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
-        assert "sleep" in step, "sleep property is required"
+    The sleep ends early when the flow is stopped (e.g. on a timeout). A long sleep of
+    a job in the thread engine is deferred: the job gives its worker back and is
+    resumed by the job queue after the sleep.
+    """
+
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._sleep = step.get("sleep", {})
-        assert "seconds" in self._sleep, "sleep seconds is required"
         self._seconds = self._sleep.get("seconds", 0)
 
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        assert "sleep" in step, "sleep property is required"
+        assert "seconds" in step["sleep"], "sleep seconds is required"
+        seconds = step["sleep"]["seconds"]
+        assert isinstance(seconds, (int, float)) and seconds >= 0, (
+            "sleep seconds must be a number >= 0"
+        )
+
     def process(self, ignore_when=False):
         """Process the sleep step."""
 
@@ -21,11 +37,31 @@ class SleepStep(Step):
         if not enabled:
             return
 
+        if self._flow._can_defer and SLEEP_DEFER_SECONDS and self._seconds >= SLEEP_DEFER_SECONDS:
+            logging.info(
+                "%s -> sleeping for %s seconds, worker released", self._representation, self._seconds
+            )
+            self._flow.defer(time.time() + self._seconds)
+            return super().process()
+
         logging.info(
             "%s -> sleeping for %s seconds", self._representation, self._seconds
         )
-        import time
-
-        time.sleep(self._seconds)
+        if self._wait(self._seconds):
+            logging.info("%s -> sleep interrupted, the flow is stopped", self._representation)
 
         return super().process()
+
+    async def process_async(self, ignore_when=False):
+        """Sleep on the event loop, in the async engine."""
+        enabled = super().pre_process(ignore_when)
+        if not enabled:
+            return
+
+        logging.info(
+            "%s -> sleeping for %s seconds", self._representation, self._seconds
+        )
+        if await self._wait_async(self._seconds):
+            logging.info("%s -> sleep interrupted, the flow is stopped", self._representation)
+
+        return await self._post_process_async()
@@ -4,42 +4,78 @@ from ..step import Step
 
 
 class SwitchStep(Step):
-    def __init__(self, step, flow):
-        super().__init__(step, flow)
-        assert "switch" in step, "Switch configuration is required"
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
         self._switch = step.get("switch")
         self._data_key = self._switch.get("data_key")
-        assert self._data_key, "Data key for switch is required"
         self._cases = self._switch.get("cases", [])
+        # the step objects of the cases, created the first time a case is taken
+        self._case_steps = {}
 
-        # Validate switch configuration
-        assert isinstance(self._switch, dict), "Switch must be a dictionary"
-        assert isinstance(self._data_key, str), "Data key must be a string"
-        assert "cases" in self._switch, "Switch cases are required"
-        assert isinstance(self._switch["cases"], list), "Switch cases must be a list"
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        assert "switch" in step, "Switch configuration is required"
+        switch = step["switch"]
 
+        # Validate switch configuration
+        assert isinstance(switch, dict), "Switch must be a dictionary"
+        assert switch.get("data_key"), "Data key for switch is required"
+        assert isinstance(switch["data_key"], str), "Data key must be a string"
+        assert "cases" in switch, "Switch cases are required"
+        assert isinstance(switch["cases"], list), "Switch cases must be a list"
+        for rule in switch["cases"]:
+            assert "when" in rule, "Each case must have a 'when' condition"
+            assert "step" in rule, "Each case must have a 'step' to execute"
+            assert isinstance(rule["step"], dict), "Each case step must be a dictionary"
+            try:
+                re.compile(rule["when"])
+            except re.error as e:
+                raise AssertionError(f"Invalid case regex {rule['when']!r}: {e}")
 
     def process(self, ignore_when=False):
         """Process the file step."""
-        from ..step_factory import create_step
         # check if the step is enabled
         enabled = super().pre_process(ignore_when)
         if not enabled:
             return
 
+        step_obj = self._select_case()
+        if step_obj:
+            return step_obj.process() # return, could be a goto step
+
+    async def process_async(self, ignore_when=False):
+        """Process the step of the matching case, in the async engine."""
+        enabled = super().pre_process(ignore_when)
+        if not enabled:
+            return
+
+        step_obj = self._select_case()
+        if step_obj:
+            return await step_obj.process_async()
+
+    def _select_case(self):
+        """Return the step object of the first matching case, bound to the flow data."""
         logging.info(
             "%s -> %s", self._representation, self._data_key
         )
 
-
         value = self._flow._data.get(self._data_key)
-        for rule in self._cases:
-            assert "when" in rule, "Each case must have a 'when' condition"
-            assert "step" in rule, "Each case must have a 'step' to execute"
+        for index, rule in enumerate(self._cases):
             logging.debug("Comparing '%s' -> '%s'",str(value),rule["when"]  )
             if re.match(rule["when"], str(value)):
-                step_conf = rule["step"]
-                step_obj = create_step(step_conf, self._flow)
-                return step_obj.process() # return, could be a goto step
+                step_obj = self._case_step(index)
+                step_obj.bind()
+                return step_obj
+        return None
 
+    def _case_step(self, index):
+        """Return the step object of a case, with the compiled case step of the flow plan."""
+        from ..step_factory import create_step
 
+        step_obj = self._case_steps.get(index)
+        if step_obj is None:
+            compiled = self._compiled.cases[index] if self._compiled is not None else None
+            step_obj = create_step(self._cases[index]["step"], self._flow, compiled)
+            self._case_steps[index] = step_obj
+        return step_obj
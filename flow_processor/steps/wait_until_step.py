@@ -0,0 +1,106 @@
+import logging
+import time
+
+from flow_processor.utils import parse_time_param, to_iso
+
+from ..step import Step
+
+
+class WaitUntilStep(Step):
+    """Subclass to suspend a job until a later time.
+
+    The job is checkpointed to the job store (flow data and next step) and gives all its
+    resources back, the job queue resumes it at the given time, also after a restart.
+    A child flow (flow, flow_loop) can't be suspended on its own, it waits in place.
+    """
+
+    def __init__(self, step, flow, compiled=None):
+        super().__init__(step, flow, compiled)
+        self._wait_until = step.get("wait_until", {})
+
+    @classmethod
+    def validate(cls, step):
+        super().validate(step)
+        assert "wait_until" in step, "wait_until property is required"
+        wait_until = step["wait_until"]
+        assert isinstance(wait_until, dict), "wait_until must be a dictionary"
+        assert ("seconds" in wait_until) != ("time" in wait_until), (
+            "wait_until requires either seconds or time"
+        )
+        seconds = wait_until.get("seconds", 0)
+        assert isinstance(seconds, (int, float, str)), "wait_until seconds must be a number"
+        assert isinstance(wait_until.get("time", ""), (int, float, str)), (
+            "wait_until time must be a timestamp or a date"
+        )
+
+    @classmethod
+    def templates(cls, step):
+        wait_until = step["wait_until"]
+        return super().templates(step) + [
+            value
+            for value in (wait_until.get("seconds"), wait_until.get("time"))
+            if isinstance(value, str)
+        ]
+
+    def _get_resume_at(self):
+        """Return the time to resume at, from the seconds to wait or the time to wait for."""
+        seconds = self._wait_until.get("seconds")
+        if seconds is not None:
+            if isinstance(seconds, str):
+                seconds = self._render(seconds)
+            try:
+                return time.time() + float(seconds)
+            except ValueError:
+                raise Exception(f"Invalid wait_until seconds: {seconds}")
+
+        until = self._wait_until["time"]
+        if isinstance(until, str):
+            until = self._render(until)
+        try:
+            # a unix timestamp, or a date (without a timezone in the configured TZ)
+            return parse_time_param(str(until))
+        except (ValueError, OverflowError):
+            raise Exception(f"Invalid wait_until time: {until}")
+
+    def process(self, ignore_when=False):
+        """Process the wait_until step."""
+
+        # check if the step is enabled
+        enabled = super().pre_process(ignore_when)
+        if not enabled:
+            return
+
+        seconds = self._suspend()
+        if seconds and self._wait(seconds):
+            logging.info("%s -> wait interrupted, the flow is stopped", self._representation)
+
+        return super().process()
+
+    async def process_async(self, ignore_when=False):
+        """Suspend the job, or wait on the event loop in a child flow, in the async engine."""
+        enabled = super().pre_process(ignore_when)
+        if not enabled:
+            return
+
+        seconds = self._suspend()
+        if seconds and await self._wait_async(seconds):
+            logging.info("%s -> wait interrupted, the flow is stopped", self._representation)
+
+        return await self._post_process_async()
+
+    def _suspend(self):
+        """Suspend the job, return the seconds to wait in place if the flow can't be suspended."""
+        resume_at = self._get_resume_at()
+        self._data = {"resume_at": to_iso(resume_at)}
+        seconds = resume_at - time.time()
+        if seconds <= 0:
+            logging.info("%s -> %s already passed", self._representation, self._data["resume_at"])
+            return 0
+        if self._flow._can_defer:
+            logging.info(
+                "%s -> suspending the job until %s", self._representation, self._data["resume_at"]
+            )
+            self._flow.defer(resume_at, durable=True)
+            return 0
+        logging.info("%s -> waiting until %s", self._representation, self._data["resume_at"])
+        return seconds
@@ -0,0 +1,61 @@
+import copy
+
+# the fields every step timing has, all other fields are counters (bytes, items, ...)
+TIMING_FIELDS = ("type", "count", "total", "max", "last", "children")
+
+
+def new_timings():
+    """Return an empty timings structure of a flow."""
+    return {"total": 0.0, "steps": {}}
+
+
+def record_step(timings, name, step_type, elapsed, metrics=None):
+    """Add one execution of a step to the timings of its flow.
+
+    Executions of the same step (e.g. in a goto loop) are aggregated. The metrics of the
+    step are added up, the "children" metric holds the timings of child flows.
+    """
+    entry = timings["steps"].get(name)
+    if entry is None:
+        entry = timings["steps"][name] = {
+            "type": step_type,
+            "count": 0,
+            "total": 0.0,
+            "max": 0.0,
+            "last": 0.0,
+        }
+    elapsed = round(elapsed, 6)
+    entry["count"] += 1
+    entry["total"] = round(entry["total"] + elapsed, 6)
+    entry["max"] = max(entry["max"], elapsed)
+    entry["last"] = elapsed
+    for key, value in (metrics or {}).items():
+        if key == "children":
+            if value:
+                entry["children"] = merge_timings(
+                    entry.get("children") or new_timings(), value
+                )
+        else:
+            entry[key] = entry.get(key, 0) + value
+
+
+def merge_timings(target, source):
+    """Add the timings of a flow to another one, e.g. of all items of a flow loop."""
+    target["total"] = round(target["total"] + source.get("total", 0.0), 6)
+    for name, step in source.get("steps", {}).items():
+        entry = target["steps"].get(name)
+        if entry is None:
+            target["steps"][name] = copy.deepcopy(step)
+            continue
+        entry["count"] += step["count"]
+        entry["total"] = round(entry["total"] + step["total"], 6)
+        entry["max"] = max(entry["max"], step["max"])
+        entry["last"] = step["last"]
+        if step.get("children"):
+            entry["children"] = merge_timings(
+                entry.get("children") or new_timings(), step["children"]
+            )
+        for key, value in step.items():
+            if key not in TIMING_FIELDS:
+                entry[key] = entry.get(key, 0) + value
+    return target
@@ -1,5 +1,7 @@
+import functools
 import logging
 import os
+import reprlib
 from datetime import datetime
 
 import jinja2
@@ -7,13 +9,34 @@ import jq
 import json
 from dateutil import parser as date_parser
 
-from flow_processor.config import TEMPLATES_PATH, TZ
+from flow_processor.config import (
+    JINJA_TEMPLATE_CACHE_SIZE,
+    JQ_PROGRAM_CACHE_SIZE,
+    TEMPLATES_PATH,
+    TZ,
+)
+
+# Shared Jinja2 environment, template files are compiled once and
+# recompiled automatically when the file changes (auto_reload)
+jinja2_env = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(TEMPLATES_PATH),
+    auto_reload=True,
+    cache_size=JINJA_TEMPLATE_CACHE_SIZE,
+)
+
+
+@functools.lru_cache(maxsize=JINJA_TEMPLATE_CACHE_SIZE)
+def compile_jinja2(template):
+    """Compile an inline Jinja2 template, compiled templates are kept in a LRU cache."""
+    return jinja2_env.from_string(template)
 
 
 def apply_jinja2(template, data):
-    """Apply Jinja2 templating to the data."""
+    """Apply Jinja2 templating to the data, the template is a string or a compiled template."""
     try:
-        result = jinja2.Template(template).render(data)
+        if isinstance(template, str):
+            template = compile_jinja2(template)
+        result = template.render(data)
         return result
     except jinja2.exceptions.TemplateError as e:
         raise Exception(f"Error processing template: {e}")
@@ -32,14 +55,52 @@ def make_json_safe(obj):
         return str(obj)  # fallback: string representation
 
 
+@functools.lru_cache(maxsize=JQ_PROGRAM_CACHE_SIZE)
+def compile_jq(expression):
+    """Compile a jq expression, compiled programs are kept in a LRU cache."""
+    # compiled programs are thread-safe, they can be shared by all workers
+    return jq.compile(expression)
+
+
+def cache_stats():
+    """Return the counters of the compiled template and jq program caches."""
+    stats = {}
+    for name, cached in (("jinja2", compile_jinja2), ("jq", compile_jq)):
+        info = cached.cache_info()
+        stats[name] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize,
+        }
+    return stats
+
+
+# limits of the payloads dumped in the debug logs
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 4
+_payload_repr.maxdict = _payload_repr.maxlist = 20
+_payload_repr.maxstring = _payload_repr.maxother = 500
+
+
+def abbreviate(data):
+    """Return a size-limited representation of a payload, for the debug logs."""
+    return _payload_repr.repr(data)
+
+
 def apply_jq_filter(data, filter):
-    """Apply jq filter to the data."""
+    """Apply jq filter to the data, the filter is an expression or a compiled program."""
     try:
-        logging.debug("Applying jq filter: %s", filter)
-        logging.debug("Input: %s", data)
-        result = jq.compile(filter).input(data).all()
+        # only dump the payloads when debug logging is enabled, they can be huge
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        if debug:
+            logging.debug("Applying jq filter: %s", filter)
+            logging.debug("Input: %s", abbreviate(data))
+        program = compile_jq(filter) if isinstance(filter, str) else filter
+        result = program.input(data).all()
         result = result[0] if len(result) == 1 else None
-        logging.debug("Result: %s", result)
+        if debug:
+            logging.debug("Result: %s", abbreviate(result))
         return result
     except Exception as e:
         raise Exception(f"Error applying jq filter: {e}")
@@ -47,18 +108,25 @@ def apply_jq_filter(data, filter):
 
 def apply_jinja2_from_file(path, data):
     """Apply Jinja2 templating from a file."""
-    logging.debug("Applying jinja2 from file: %s", path)
-    logging.debug("Input: %s", data)
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    if debug:
+        logging.debug("Applying jinja2 from file: %s", path)
+        logging.debug("Input: %s", abbreviate(data))
     try:
-        with open(os.path.join(TEMPLATES_PATH, path), "r") as file:
-            template = file.read()
-        result = jinja2.Template(template).render(data)
-        logging.debug("Result: %s", result)
+        result = jinja2_env.get_template(path).render(data)
+        if debug:
+            logging.debug("Result: %s", abbreviate(result))
         return result
+    except jinja2.exceptions.TemplateNotFound as e:
+        raise Exception(f"File not found: {os.path.join(TEMPLATES_PATH, e.name)}")
     except jinja2.exceptions.TemplateError as e:
         raise Exception(f"Error processing template: {e}")
-    except FileNotFoundError as e:
-        raise Exception(f"File not found: {e}")
+
+
+def file_signature(path):
+    """Return a (mtime, size) signature of a file, used to detect changes."""
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
 
 
 def string_to_key(str):